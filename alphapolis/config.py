@@ -0,0 +1,82 @@
+# --- coding: utf-8 ---
+"""
+アルファポリスの設定モジュール
+"""
+
+from sink import OUTPUT_DIRECTORY, OUTPUTS
+
+
+class Config(object):
+    """
+    設定情報を管理するためのクラス
+    """
+
+    def __init__(self, data=None):
+        """
+        設定情報を管理するためのコンストラクタ
+        @param data 設定情報
+        """
+        self.workers = 4
+        """
+        画像を並行してダウンロードするワーカの数
+        """
+        self.retries = 3
+        """
+        ダウンロードに失敗した場合に再試行する回数
+        """
+        self.backoff = 0.5
+        """
+        再試行するまでの待ち時間の基準秒数
+        再試行するごとに倍になる
+        """
+        self.connect_timeout = 10.0
+        """
+        接続を待つ最大秒数
+        """
+        self.read_timeout = 30.0
+        """
+        レスポンスの受信が止まってから待つ最大秒数
+        """
+        self.resume = False
+        """
+        出力先に記録が残っている場合に書き出し済みのページを飛ばすかどうか
+        """
+        self.output = OUTPUT_DIRECTORY
+        """
+        ページの出力形式
+        使用できる形式は sink.OUTPUTS に記されている
+        """
+        if isinstance(data, dict):
+            self.update(data)
+        return
+
+    def update(self, data):
+        """
+        設定情報を更新する
+        @param data 更新するデータ
+        """
+        if 'workers' in data:
+            self.workers = max(1, int(data['workers']))
+        if 'retries' in data:
+            self.retries = max(0, int(data['retries']))
+        if 'backoff' in data:
+            self.backoff = max(0, float(data['backoff']))
+        if 'connect_timeout' in data:
+            self.connect_timeout = max(0.1, float(data['connect_timeout']))
+        if 'read_timeout' in data:
+            self.read_timeout = max(0.1, float(data['read_timeout']))
+        if 'resume' in data:
+            self.resume = data['resume']
+        if 'output' in data:
+            self._set_output(data['output'])
+        return
+
+    def _set_output(self, output):
+        """
+        ページの出力形式を設定する
+        使用できない形式の場合は変更しない
+        @param output 出力形式
+        """
+        if isinstance(output, str) and output.lower() in OUTPUTS:
+            self.output = output.lower()
+        return
@@ -3,10 +3,18 @@
 アルファポリスから漫画をダウンロードするためのクラスモジュール
 """
 
-from urllib import request
+from concurrent.futures import ThreadPoolExecutor
 from os import path
+from alphapolis.config import Config
+from manifest import Manifest
+from profiler import PhaseTimer
+from rate_limiter import THROTTLE_STATUSES, RateLimiter
+from sink import create_sink
+import urllib3
+import hashlib
 import os
 import re
+import time
 
 
 class Manager(object):
@@ -14,11 +22,58 @@ class Manager(object):
     アルファポリスから漫画をダウンロードするクラス
     """
 
-    def __init__(self, directory='./', prefix=''):
+    CHUNK_SIZE = 64 * 1024
+    """
+    画像をファイルに書き出す単位のバイト数
+    """
+
+    RETRY_STATUSES = [500, 502, 504]
+    """
+    コネクションプールで再試行する HTTP ステータスコードのリスト
+    429 と 503 はリクエストの頻度を下げてから再試行する
+    """
+
+    SERIES_PATTERN = re.compile(r'manga/official/(\d+)/?(\?.*)?$')
+    """
+    作品の URL の正規表現のパターン
+    """
+
+    IMAGE_SIGNATURES = [
+        (b'\xff\xd8\xff', '.jpg'),
+        (b'\x89PNG\r\n\x1a\n', '.png'),
+        (b'GIF87a', '.gif'),
+        (b'GIF89a', '.gif')]
+    """
+    画像の種類を判定する先頭のバイト列と拡張子のタプルのリスト
+    """
+
+    def __init__(self, directory='./', prefix='', config=None):
         """
         アルファポリスの操作を行うためのコンストラクタ
         @param directory 出力するファイル群を置くディレクトリ
         @param prfix 出力するファイル名のプレフィックス
+        @param config Config 設定情報
+        """
+        self.config = config if isinstance(config, Config) else Config()
+        """
+        アルファポリスの設定情報
+        """
+        self.http = urllib3.PoolManager(
+            maxsize=self.config.workers,
+            timeout=urllib3.Timeout(
+                connect=self.config.connect_timeout,
+                read=self.config.read_timeout),
+            retries=urllib3.Retry(
+                total=self.config.retries,
+                backoff_factor=self.config.backoff,
+                status_forcelist=Manager.RETRY_STATUSES,
+                raise_on_status=False))
+        """
+        接続を使い回すためのコネクションプール
+        """
+        self.limiter = RateLimiter.get_shared()
+        """
+        ホストごとのリクエストの頻度と同時実行数の制御
         """
         self.directory = None
         """
@@ -30,6 +85,18 @@ class Manager(object):
         """
         self._set_directory(directory)
         self._set_prefix(prefix)
+        self.manifest = Manifest(self.directory)
+        """
+        書き出したページの記録
+        """
+        self.timer = PhaseTimer()
+        """
+        フェーズごとの所要時間の集計
+        """
+        self.sink = None
+        """
+        ページの出力先
+        """
         return
 
     def _set_directory(self, directory):
@@ -50,23 +117,245 @@ class Manager(object):
     def start(self, url):
         """
         ページの自動自動ダウンロードを開始する
+        作品の URL の場合はすべての話をダウンロードする
         @param url アルフォポリスのコンテンツの URL
+        @return エラーが合った場合にエラーメッセージを、成功時に True を返す
         """
+        self.timer = PhaseTimer()
         self._check_directory(self.directory)
+        if Manager.SERIES_PATTERN.search(url) is not None:
+            return self._start_series(url)
+        if self.config.resume:
+            self.manifest.load()
+        self.sink = create_sink(
+            self.config.output, self.directory, self.manifest)
         _sources = self._get_image_urls(url)
-        _total = len(_sources)
-        for _index in range(_total):
-            self._print_progress(_total, _index)
-            _response = request.urlopen(_sources[_index])
-            if _response.getcode() != 200:
-                print('画像の取得に失敗しました(%s)' % _sources[_index])
+        if len(_sources) == 0:
+            return 'ページの取得に失敗しました'
+        _failures = self._download_all([(self.sink, self.directory, _sources)])
+        self._save_timing()
+        if _failures != 0:
+            return '%d ページの取得に失敗しました' % _failures
+        return True
+
+    def _start_series(self, url):
+        """
+        作品のすべての話をダウンロードする
+        各話のページ情報を並行して取得し，すべての画像を 1 つのワーカのプールでダウンロードする
+        各話は話の番号のディレクトリに書き出す
+        @param url アルファポリスの作品の URL
+        @return エラーが合った場合にエラーメッセージを、成功時に True を返す
+        """
+        _episodes = self._get_episode_urls(url)
+        if len(_episodes) == 0:
+            return '話の一覧の取得に失敗しました'
+        print('%d episodes' % len(_episodes))
+        with ThreadPoolExecutor(self.config.workers) as _executor:
+            _sources_list = list(_executor.map(
+                self._get_image_urls, _episodes))
+        _jobs = []
+        _missings = []
+        for _episode, _sources in zip(_episodes, _sources_list):
+            if len(_sources) == 0:
+                _missings.append(_episode)
                 continue
-            with open('%s%s%03d.png' % (
-                    self.directory, self.prefix, _index), 'wb') as file:
-                file.write(_response.read())
+            _directory = '%s%s/' % (
+                self.directory, _episode.rstrip('/').rsplit('/', 1)[1])
+            self._check_directory(_directory)
+            _manifest = Manifest(_directory)
+            if self.config.resume:
+                _manifest.load()
+            _jobs.append((
+                create_sink(self.config.output, _directory, _manifest),
+                _directory, _sources))
+        _failures = self._download_all(_jobs)
+        self._save_timing()
+        for _episode in _missings:
+            print('ページの取得に失敗しました(%s)' % _episode)
+        if _failures != 0 or len(_missings) != 0:
+            return '%d ページ， %d 話の取得に失敗しました' % (
+                _failures, len(_missings))
+        return True
+
+    def _download_all(self, jobs):
+        """
+        出力先ごとの画像を 1 つのワーカのプールでダウンロードする
+        書き出しが完了しているページは飛ばし，すべて終えた後に出力先を閉じる
+        @param jobs 出力先と出力ディレクトリ，画像の URL のリストのタプルのリスト
+        @return 取得に失敗したページ数
+        """
+        _total = sum(len(_sources) for _, _, _sources in jobs)
+        _failures = 0
+        with ThreadPoolExecutor(self.config.workers) as _executor:
+            _futures = [
+                (_source, None if _sink.is_completed(_index) else
+                 _executor.submit(
+                     self._download, _sink, _index, _source, '%s%s%03d' % (
+                         _directory, self.prefix, _index)))
+                for _sink, _directory, _sources in jobs
+                for _index, _source in enumerate(_sources)]
+            for _count, (_source, _future) in enumerate(_futures):
+                self._print_progress(_total, _count)
+                if _future is None:
+                    continue
+                try:
+                    _future.result()
+                except Exception as err:
+                    _failures = _failures + 1
+                    print('画像の取得に失敗しました(%s): %s' % (_source, err))
+        for _sink, _directory, _ in jobs:
+            try:
+                _sink.close()
+            except Exception as err:
+                _failures = _failures + 1
+                print('出力先を閉じられませんでした(%s): %s' % (_directory, err))
         self._print_progress(_total, is_end=True)
+        return _failures
+
+    def _save_timing(self):
+        """
+        フェーズごとの所要時間の集計結果を出力ディレクトリに書き出す
+        """
+        _filename = self.timer.save(self.directory)
+        _summary = self.timer.summary()
+        print('Timing: %s (%.2f pages/s, %d bytes)' % (
+            _filename, _summary['pages_per_second'],
+            _summary['bytes_written']))
+        for _host, _stats in sorted(self.limiter.stats().items()):
+            print('Rate limit: %s %.1f requests/s, concurrency %d' % (
+                _host, _stats['rate'], _stats['concurrency']))
         return
 
+    def _download(self, sink, index, url, destination):
+        """
+        画像をダウンロードしてファイルに書き出す
+        レスポンスは一定サイズごとに一時ファイルに書き出し，通信エラーの場合は待ち時間を延ばしながら再試行する
+        一時ファイルが残っている場合は Range リクエストで続きから取得する
+        バイト数と画像の種類を確認し，画像の種類に合った拡張子で出力先に渡して記録に追加する
+        @param sink ページの出力先
+        @param index ページの連番
+        @param url 画像の URL
+        @param destination 拡張子を除いた出力するファイルのパス
+        """
+        _temporary = destination + Manifest.TEMPORARY_SUFFIX
+        if not self.config.resume and path.isfile(_temporary):
+            os.remove(_temporary)
+        for _try_count in range(self.config.retries + 1):
+            try:
+                _size, _checksum = self._fetch(url, _temporary)
+                break
+            except urllib3.exceptions.HTTPError:
+                if self.config.retries <= _try_count:
+                    raise
+                time.sleep(self.config.backoff * (2 ** _try_count))
+        with open(_temporary, 'rb') as _file:
+            _extension = self._get_extension(_file.read(12))
+        if _extension is None:
+            os.remove(_temporary)
+            raise IOError('画像ではないデータを受信しました')
+        with self.timer.measure('write'):
+            sink.write_file(
+                index, destination + _extension, url, _temporary, _checksum)
+        self.timer.add_page(_size)
+        return
+
+    def _fetch(self, url, temporary):
+        """
+        画像を一時ファイルに書き出す
+        一時ファイルが残っている場合は続きから追記し，サーバが Range リクエストに応じない場合は最初から書き直す
+        リクエストはホストごとの頻度と同時実行数の制御の下で行う
+        @param url 画像の URL
+        @param temporary 一時ファイルのパス
+        @return 書き出したバイト数と SHA-256 のチェックサムのタプル
+        """
+        _hash = hashlib.sha256()
+        _size = path.getsize(temporary) if path.isfile(temporary) else 0
+        _headers = {'Range': 'bytes=%d-' % _size} if _size != 0 else {}
+        with self.limiter.limit(url) as _slot:
+            with self.timer.measure('fetch'):
+                _response = self.http.request(
+                    'GET', url, headers=_headers, preload_content=False,
+                    enforce_content_length=True)
+            _slot.report(
+                _response.status, _response.headers.get('Retry-After'))
+            try:
+                _length = self._receive(_response, temporary, _size, _hash)
+            finally:
+                _response.release_conn()
+        _size = path.getsize(temporary)
+        if _length is not None and _size != _length:
+            raise urllib3.exceptions.ProtocolError(
+                '画像の受信が途中で終わりました(%d/%d bytes)' % (_size, _length))
+        return _size, _hash.hexdigest()
+
+    def _receive(self, response, temporary, offset, hash):
+        """
+        レスポンスの本文を一定サイズごとに一時ファイルに書き出す
+        続きを受け取った場合は一時ファイルの既存の内容もチェックサムに含める
+        @param response 画像のレスポンス
+        @param temporary 一時ファイルのパス
+        @param offset Range リクエストで指定した開始位置
+        @param hash SHA-256 のチェックサムを計算するオブジェクト
+        @return 画像全体のバイト数，ヘッダから分からない場合は None を返す
+        """
+        if response.status in THROTTLE_STATUSES:
+            raise urllib3.exceptions.ResponseError('HTTP %d' % response.status)
+        if response.status == 416:
+            os.remove(temporary)
+            raise urllib3.exceptions.ProtocolError(
+                '途中まで取得した画像の続きを取得できません')
+        if response.status == 206 and offset != 0:
+            _length = self._get_content_length(response, offset)
+            with open(temporary, 'rb') as _file:
+                for _chunk in iter(
+                        lambda: _file.read(Manager.CHUNK_SIZE), b''):
+                    hash.update(_chunk)
+            _mode = 'ab'
+        elif response.status == 200:
+            _length = self._get_content_length(response, 0)
+            _mode = 'wb'
+        else:
+            raise IOError('HTTP %d' % response.status)
+        with self.timer.measure('transfer'):
+            with open(temporary, _mode) as _file:
+                for _chunk in response.stream(Manager.CHUNK_SIZE):
+                    _file.write(_chunk)
+                    hash.update(_chunk)
+        return _length
+
+    def _get_content_length(self, response, offset):
+        """
+        レスポンスのヘッダから画像全体のバイト数を求める
+        @param response 画像のレスポンス
+        @param offset Range リクエストで指定した開始位置
+        @return 画像全体のバイト数，ヘッダから分からない場合は None を返す
+        """
+        _range = response.headers.get('Content-Range')
+        if _range is not None:
+            _match = re.match(r'bytes\s+(\d+)-\d+/(\d+|\*)', _range)
+            if _match is None or int(_match.group(1)) != offset:
+                raise urllib3.exceptions.ProtocolError(
+                    '不正な Content-Range を受信しました(%s)' % _range)
+            if _match.group(2) != '*':
+                return int(_match.group(2))
+        _length = response.headers.get('Content-Length')
+        if _length is not None and _length.isdigit():
+            return offset + int(_length)
+        return None
+
+    def _get_extension(self, header):
+        """
+        ファイルの先頭のバイト列から画像の種類を判定して拡張子を取得する
+        @param header ファイルの先頭 12 バイト
+        @return 拡張子，画像ではない場合は None を返す
+        """
+        for _signature, _extension in Manager.IMAGE_SIGNATURES:
+            if header.startswith(_signature):
+                return _extension
+        if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+            return '.webp'
+        return None
+
     def _check_directory(self, directory):
         """
         ディレクトリの存在を確認して，ない場合はそのディレクトリを作成する
@@ -94,17 +383,49 @@ class Manager(object):
             print('\x1B[10000D', end='', flush=True)
         return
 
+    def _request_page(self, url):
+        """
+        HTML のページをホストごとの頻度と同時実行数の制御の下で取得する
+        @param url ページの URL
+        @return ページのレスポンス
+        """
+        with self.limiter.limit(url) as _slot:
+            with self.timer.measure('page_fetch'):
+                _response = self.http.request('GET', url)
+            _slot.report(
+                _response.status, _response.headers.get('Retry-After'))
+        return _response
+
+    def _get_episode_urls(self, url):
+        """
+        作品のページから各話の URL を取得する
+        @param url アルファポリスの作品の URL
+        @return 話の番号順に並べた各話の URL のリスト
+        """
+        _series = Manager.SERIES_PATTERN.search(url).group(1)
+        _response = self._request_page(url)
+        if _response.status != 200:
+            print("作品ページの取得に失敗しました")
+            return []
+        _numbers = set(re.findall(
+            r"manga/official/%s/(\d+)" % _series,
+            _response.data.decode('utf-8', 'replace')))
+        _base = url[:url.index('manga/official/')]
+        return [
+            '%smanga/official/%s/%s' % (_base, _series, _number)
+            for _number in sorted(_numbers, key=int)]
+
     def _get_image_urls(self, url):
         """
         漫画画像の URL を取得する
         @param url アルファボリスで漫画を表示しているページの URL
         @return ページの URL のリスト
         """
-        _response = request.urlopen(url)
-        if _response.getcode() != 200:
+        _response = self._request_page(url)
+        if _response.status != 200:
             print("漫画データの取得に失敗しました")
             return []
-        _html = str(_response.read())
+        _html = str(_response.data)
         _matches = re.findall(r"var\s+_base\s*=\s*\"([^\"]+)\";", _html)
         if len(_matches) == 0:
             print("漫画情報のURLの取得に失敗しました")
@@ -27,11 +27,20 @@ class Runner(AbstractRunner):
     サポートするアルファポリスのパスの正規表現のパターンのリスト
     """
 
+    needs_browser = False
+    """
+    画像を直接ダウンロードするためブラウザは使わない
+    """
+
     def run(self):
         """
         アルファポリスの実行
+        @return 成功時に True を返す
         """
-        _destination = input('Output Path > ')
-        _manager = Manager(_destination)
-        _manager.start(self.url)
-        return
+        _manager = Manager(
+            self.get_destination(), config=self.config.alphapolis)
+        _result = self.start_manager(_manager, self.url)
+        if _result is not True:
+            print(_result)
+            return False
+        return True
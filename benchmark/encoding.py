@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# --- coding: utf-8 ---
+"""
+ebookjapan の画像のエンコード設定ごとの 1 ページあたりのサイズと処理時間を比較するベンチマーク
+スクリーンショットを模した画像をトリミングしてエンコードするまでを計測する
+"""
+
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from ebookjapan.config import Config, ImageFormat  # noqa: E402
+from ebookjapan.manager import Manager  # noqa: E402
+from screenshots import make_screenshot  # noqa: E402
+
+
+SETTINGS = [
+    (ImageFormat.JPEG, {'quality': 75}),
+    (ImageFormat.JPEG, {'quality': 90}),
+    (ImageFormat.JPEG, {'quality': 90, 'subsampling': 0}),
+    (ImageFormat.JPEG, {'quality': 75, 'optimize': True}),
+    (ImageFormat.JPEG, {'quality': 75, 'progressive': True}),
+    (ImageFormat.PNG, {'compress_level': 1}),
+    (ImageFormat.PNG, {'compress_level': 6}),
+    (ImageFormat.PNG, {'compress_level': 9}),
+    (ImageFormat.WEBP, {'quality': 80, 'method': 0}),
+    (ImageFormat.WEBP, {'quality': 80, 'method': 4}),
+    (ImageFormat.WEBP, {'quality': 90, 'method': 6}),
+    (ImageFormat.WEBP_LOSSLESS, {'quality': 0, 'method': 0}),
+    (ImageFormat.WEBP_LOSSLESS, {'quality': 80, 'method': 4})]
+"""
+計測する画像のフォーマットとエンコーダの設定のリスト
+"""
+
+
+def _measure(manager, image, repeat):
+    """
+    トリミングとエンコードの 1 回あたりの平均実行時間を計測する
+    @param manager 設定を済ませた Manager
+    @param image トリミングする画像
+    @param repeat 繰り返し回数
+    @return エンコードした画像のバイト数と 1 回あたりのミリ秒のタプル
+    """
+    _format = manager._get_save_format()
+    _start = time.perf_counter()
+    for _ in range(repeat):
+        _data = manager._triming(image, _format)
+    return len(_data), (time.perf_counter() - _start) * 1000 / repeat
+
+
+def _main():
+    _repeat = 5
+    _image = make_screenshot(1920, 1080)
+    _image.load()
+    _sources = [('RGBA', _image), ('RGB', _image.convert('RGB'))]
+    _manager = Manager(None, None, '')
+    print('%-14s %-44s %-5s %10s %10s' % (
+        'format', 'options', 'mode', 'bytes', 'time'))
+    for _format, _options in SETTINGS:
+        _manager.config = Config({
+            'image_format': _format.name,
+            'encoder_options': {_format.name: _options}})
+        for _mode, _source in _sources:
+            _size, _time = _measure(_manager, _source, _repeat)
+            print('%-14s %-44s %-5s %10d %8.2fms' % (
+                _format.name, ', '.join(
+                    '%s=%s' % _ for _ in sorted(_options.items())),
+                _mode, _size, _time))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
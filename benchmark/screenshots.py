@@ -0,0 +1,60 @@
+# --- coding: utf-8 ---
+"""
+ベンチマーク用にスクリーンショットを模した画像を生成するモジュール
+"""
+
+import random
+from PIL import Image, ImageDraw
+
+
+BACKGROUND_COLOR = (0xFE, 0xFF, 0xFD, 0xFF)
+"""
+ebookjapan.manager.Manager.BACKGEROUND_COLOR に合わせた余白の色
+"""
+
+SIZES = [(1280, 800), (1920, 1080), (2880, 1800)]
+"""
+生成するスクリーンショットのサイズのリスト
+"""
+
+
+def make_screenshot(width, height, seed=0):
+    """
+    左右の余白と漫画のような見開きページを含むスクリーンショットを模した画像を生成する
+    同じ引数からは常に同じ画像を生成する
+    @param width 画像の横幅
+    @param height 画像の高さ
+    @param seed 乱数のシード
+    @return 生成した画像
+    """
+    _random = random.Random(seed)
+    _image = Image.new('RGBA', (width, height), BACKGROUND_COLOR)
+    _draw = ImageDraw.Draw(_image)
+    _left = int(width * 0.2)
+    _right = int(width * 0.8)
+    _draw.rectangle((_left, 0, _right, height), fill=(0xFF, 0xFF, 0xFF, 0xFF))
+    _middle = (_left + _right) // 2
+    for _page_left, _page_right in [(_left, _middle), (_middle, _right)]:
+        _top = 40
+        while _top < height - 120:
+            _bottom = min(height - 40, _top + _random.randint(160, 400))
+            _draw.rectangle(
+                (_page_left + 30, _top, _page_right - 30, _bottom),
+                outline=(0x10, 0x10, 0x10, 0xFF), width=4)
+            for _ in range(_random.randint(10, 40)):
+                _draw.line(
+                    (_random.randint(_page_left + 40, _page_right - 40),
+                     _random.randint(_top + 10, _bottom - 10),
+                     _random.randint(_page_left + 40, _page_right - 40),
+                     _random.randint(_top + 10, _bottom - 10)),
+                    fill=(_random.randint(0, 0x80),) * 3 + (0xFF,),
+                    width=_random.randint(1, 4))
+            for _ in range(_random.randint(0, 3)):
+                _x = _random.randint(_page_left + 40, _page_right - 140)
+                _y = _random.randint(_top + 10, max(_top + 11, _bottom - 110))
+                _draw.ellipse(
+                    (_x, _y, _x + 100, _y + 100),
+                    fill=(0xFF, 0xFF, 0xFF, 0xFF),
+                    outline=(0, 0, 0, 0xFF), width=2)
+            _top = _bottom + 20
+    return _image
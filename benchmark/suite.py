@@ -0,0 +1,269 @@
+#!/usr/bin/env python
+# --- coding: utf-8 ---
+"""
+ネットワークを使わずに実行できるベンチマークスイート
+合成したスクリーンショットでのトリミングと書き出し，ローカルの HTTP サーバに対する
+アルファポリスのダウンロードの実行時間を計測し，結果を JSON で書き出す
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from os import path
+from socketserver import ThreadingMixIn
+from threading import Thread
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+import PIL  # noqa: E402
+from alphapolis.config import Config as AlphapolisConfig  # noqa: E402
+from alphapolis.manager import Manager as AlphapolisManager  # noqa: E402
+from ebookjapan.config import Config as EbookjapanConfig  # noqa: E402
+from ebookjapan.config import ImageFormat  # noqa: E402
+from ebookjapan.manager import Manager as EbookjapanManager  # noqa: E402
+from manifest import Manifest  # noqa: E402
+from rate_limiter import RateLimiter  # noqa: E402
+from screenshots import SIZES, make_screenshot  # noqa: E402
+from sink import OUTPUTS, create_sink  # noqa: E402
+
+
+PAGE_COUNT = 40
+"""
+偽のビューアページに含めるページ数
+"""
+
+PAGE_SIZE = 300 * 1024
+"""
+偽のページ画像のバイト数
+"""
+
+UNLIMITED_RATE = 1000000
+"""
+ローカルの HTTP サーバへのリクエストを実質的に制限しない 1 秒あたりのリクエスト数
+"""
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """
+    リクエストごとにスレッドを立てる HTTP サーバ
+    """
+
+    daemon_threads = True
+
+
+class _ViewerHandler(BaseHTTPRequestHandler):
+    """
+    偽のビューアページとページ画像を返すリクエストハンドラ
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    contents = {}
+    """
+    パスをキーとするレスポンスのバイト列の辞書
+    """
+
+    def do_GET(self):
+        _body = _ViewerHandler.contents.get(self.path)
+        if _body is None:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(_body)))
+        self.end_headers()
+        self.wfile.write(_body)
+
+    def log_message(self, format, *args):
+        return
+
+
+def _start_server():
+    """
+    偽のビューアページを返すローカルの HTTP サーバを起動する
+    @return HTTP サーバとビューアページの URL のタプル
+    """
+    _server = _ThreadingHTTPServer(('127.0.0.1', 0), _ViewerHandler)
+    _base = 'http://127.0.0.1:%d/images/' % _server.server_address[1]
+    _pages = ''.join(
+        '_pages.push("%d.jpg");\n' % _index
+        for _index in range(1, PAGE_COUNT + 1))
+    _html = (
+        '<html><script>\nvar _base = "%s";\nvar _pages = [];\n%s' +
+        '</script></html>') % (_base, _pages)
+    _ViewerHandler.contents = {'/viewer': _html.encode('utf-8')}
+    for _index in range(1, PAGE_COUNT + 1):
+        _ViewerHandler.contents['/images/%d.jpg' % _index] = (
+            b'\xff\xd8\xff' + os.urandom(PAGE_SIZE - 3))
+    Thread(target=_server.serve_forever, daemon=True).start()
+    return _server, 'http://127.0.0.1:%d/viewer' % _server.server_address[1]
+
+
+def _measure(name, params, function, repeat, setup=None):
+    """
+    関数を繰り返し実行して 1 回あたりの実行時間を計測する
+    @param name ベンチマーク名
+    @param params ベンチマークの条件の辞書
+    @param function 計測する関数
+    @param repeat 繰り返し回数
+    @param setup 計測前に毎回実行する関数
+    @return 計測結果の辞書
+    """
+    _times = []
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        _start = time.perf_counter()
+        function()
+        _times.append((time.perf_counter() - _start) * 1000)
+    _sorted = sorted(_times)
+    _result = {
+        'name': name,
+        'params': params,
+        'runs': repeat,
+        'mean_ms': sum(_times) / repeat,
+        'p50_ms': _sorted[(repeat - 1) // 2],
+        'min_ms': _sorted[0]}
+    print('%-24s %-60s %9.2fms' % (
+        name, json.dumps(params, sort_keys=True), _result['mean_ms']))
+    return _result
+
+
+def _make_page_writer(manager, output, image):
+    """
+    出力先を作り直し，呼び出すたびに次の連番のページを書き出す関数を生成する
+    @param manager ebookjapan の Manager
+    @param output 出力形式
+    @param image 書き出すスクリーンショットの画像
+    @return ページを書き出す関数
+    """
+    manager.manifest = Manifest(manager.directory)
+    manager.sink = create_sink(output, manager.directory, manager.manifest)
+    _format = manager._get_save_format()
+    _indexes = itertools.count()
+
+    def _write_page():
+        _index = next(_indexes)
+        manager._write_page(_index, _index + 1, image, '%s%s%03d%s' % (
+            manager.directory, output, _index, manager._get_extension()),
+            _format)
+    return _write_page
+
+
+def _benchmark_ebookjapan(directory, repeat):
+    """
+    ebookjapan のトリミングと書き出しを計測する
+    @param directory 出力に使う作業ディレクトリ
+    @param repeat 繰り返し回数
+    @return 計測結果のリスト
+    """
+    _results = []
+    for _width, _height in SIZES:
+        _image = make_screenshot(_width, _height)
+        _image.load()
+        _size = '%dx%d' % (_width, _height)
+        _manager = EbookjapanManager(
+            None, EbookjapanConfig(), path.join(directory, _size))
+        _results.append(_measure(
+            'ebookjapan.triming_range', {'size': _size},
+            lambda: _manager._get_triming_range(_image), repeat))
+        _results.append(_measure(
+            'ebookjapan.cached_range', {'size': _size},
+            lambda: _manager._get_cached_triming_range(_image), repeat))
+        for _format in [ImageFormat.JPEG, ImageFormat.PNG]:
+            _manager.config.image_format = _format
+            _save_format = _manager._get_save_format()
+            _params = {'size': _size, 'format': _format.name}
+            _results.append(_measure(
+                'ebookjapan.triming', _params,
+                lambda: _manager._triming(_image, _save_format), repeat))
+            _manager._check_directory(_manager.directory)
+            for _output in OUTPUTS:
+                _results.append(_measure(
+                    'ebookjapan.write_page', dict(_params, output=_output),
+                    _make_page_writer(_manager, _output, _image), repeat))
+                _manager.sink.close()
+    return _results
+
+
+def _reset_alphapolis(manager, output):
+    """
+    出力ディレクトリを削除し，制限しない新しい RateLimiter に差し替える
+    前回の計測で学習したホストごとの頻度を持ち越さないようにする
+    @param manager アルファポリスの Manager
+    @param output 出力ディレクトリのパス
+    """
+    shutil.rmtree(output, ignore_errors=True)
+    manager.limiter = RateLimiter(
+        UNLIMITED_RATE, UNLIMITED_RATE, UNLIMITED_RATE,
+        manager.config.workers)
+    return
+
+
+def _benchmark_alphapolis(directory, repeat):
+    """
+    ローカルの HTTP サーバに対してアルファポリスのダウンロードを計測する
+    リクエストの頻度は制限せず，ダウンロード処理そのものを計測する
+    @param directory 出力に使う作業ディレクトリ
+    @param repeat 繰り返し回数
+    @return 計測結果のリスト
+    """
+    _results = []
+    _server, _url = _start_server()
+    try:
+        _output = path.join(directory, 'alphapolis')
+        _manager = AlphapolisManager(_output)
+        _reset_alphapolis(_manager, _output)
+        _results.append(_measure(
+            'alphapolis.get_image_urls', {'pages': PAGE_COUNT},
+            lambda: _manager._get_image_urls(_url), repeat))
+        for _workers in [1, 4, 8]:
+            _output = path.join(directory, 'alphapolis-%d' % _workers)
+            _manager = AlphapolisManager(
+                _output, config=AlphapolisConfig({'workers': _workers}))
+            _results.append(_measure(
+                'alphapolis.start',
+                {'pages': PAGE_COUNT, 'workers': _workers},
+                lambda: _manager.start(_url), repeat,
+                setup=lambda: _reset_alphapolis(_manager, _output)))
+    finally:
+        _server.shutdown()
+        _server.server_close()
+    return _results
+
+
+def _main():
+    _parser = argparse.ArgumentParser(
+        description='Run offline benchmarks of K-AutoBook.')
+    _parser.add_argument(
+        '--output', metavar='FILE', default='benchmark.json',
+        help='file to write the results to as JSON')
+    _parser.add_argument(
+        '--repeat', metavar='N', type=int, default=5,
+        help='number of runs of each benchmark')
+    _arguments = _parser.parse_args()
+    _directory = tempfile.mkdtemp(prefix='k_auto_book-benchmark-')
+    try:
+        _results = _benchmark_ebookjapan(_directory, _arguments.repeat)
+        _results.extend(_benchmark_alphapolis(_directory, _arguments.repeat))
+    finally:
+        shutil.rmtree(_directory, ignore_errors=True)
+    with open(_arguments.output, 'w') as _file:
+        json.dump({
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'pillow': PIL.__version__,
+            'platform': platform.platform(),
+            'results': _results}, _file, indent=2, sort_keys=True)
+    print('Results: %s' % _arguments.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# --- coding: utf-8 ---
+"""
+ebookjapan のトリミング処理の実行時間を計測するベンチマーク
+フルサイズのスクリーンショットを模した画像で 1 ページあたりの処理時間を比較する
+"""
+
+import sys
+import time
+from os import path
+
+sys.path.insert(0, path.dirname(path.dirname(path.abspath(__file__))))
+
+from ebookjapan.manager import Manager  # noqa: E402
+from screenshots import make_screenshot  # noqa: E402
+
+
+def _legacy_triming_range(image):
+    """
+    getpixel を使った従来のトリミング範囲の取得処理
+    @param image 判定する画像
+    @return トリミングする開始 X 座標と終了 X 座標のタプル
+    """
+    _width, _height = image.size
+    _start_x = 0
+    _end_x = _width
+    _bases = set()
+    for _point_y in range(_height):
+        _bases.add(image.getpixel((0, _point_y)))
+        _bases.add(image.getpixel((_width - 1, _point_y)))
+    for _point_x in range(_width):
+        _pixel = image.getpixel((_point_x, Manager.CHECK_Y))
+        if _pixel not in _bases:
+            _start_x = _point_x
+            break
+    for _point_x in range(_width)[::-1]:
+        _pixel = image.getpixel((_point_x, Manager.CHECK_Y))
+        if _pixel not in _bases:
+            _end_x = _point_x + 1
+            break
+    if _start_x != 0:
+        _start_x = _start_x + Manager.TRIMING_INSET
+        _end_x = _end_x - Manager.TRIMING_INSET
+    return _start_x, _end_x
+
+
+def _measure(function, image, repeat):
+    """
+    関数の 1 回あたりの平均実行時間を計測する
+    @param function 計測する関数
+    @param image 関数に渡す画像
+    @param repeat 繰り返し回数
+    @return 関数の戻り値と 1 回あたりのミリ秒のタプル
+    """
+    _start = time.perf_counter()
+    for _ in range(repeat):
+        _result = function(image)
+    return _result, (time.perf_counter() - _start) * 1000 / repeat
+
+
+def _main():
+    _manager = Manager(None, None, '')
+    _repeat = 20
+    print('%-11s %-10s %-10s %s' % ('size', 'before', 'after', 'range'))
+    for _width, _height in [(1920, 1080), (2880, 1800)]:
+        _image = make_screenshot(_width, _height)
+        _image.load()
+        _before, _before_time = _measure(
+            _legacy_triming_range, _image, _repeat)
+        _after, _after_time = _measure(
+            _manager._get_triming_range, _image, _repeat)
+        if _before != _after:
+            print('トリミング範囲が一致しません: %s != %s' % (_before, _after))
+            return 1
+        print('%-11s %-10s %-10s %s' % (
+            '%dx%d' % (_width, _height),
+            '%.2fms' % _before_time, '%.2fms' % _after_time, _after))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(_main())
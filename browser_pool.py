@@ -0,0 +1,179 @@
+# --- coding: utf-8 ---
+"""
+ブラウザの起動と，複数のブラウザでのジョブの並行実行を管理するためのクラスモジュール
+"""
+
+from queue import Queue, Empty
+from threading import Thread, Lock, Timer
+
+
+class BrowserPool(object):
+    """
+    待機中のブラウザにジョブを割り当てて並行して実行するためのクラス
+    """
+
+    def __init__(self, browsers):
+        """
+        複数のブラウザでジョブを実行するためのコンストラクタ
+        @param browsers splinter のブラウザインスタンスのリスト
+        """
+        self.browsers = browsers
+        """
+        splinter のブラウザインスタンスのリスト
+        """
+        self._lock = Lock()
+        """
+        進捗を更新するためのロック
+        """
+        return
+
+    def run(self, jobs, function):
+        """
+        ジョブをすべて実行する
+        各ブラウザは 1 つのジョブが終わると次の未実行のジョブを取り出して実行する
+        @param jobs ジョブのリスト
+        @param function ブラウザとジョブを受け取ってジョブを実行し，その結果を返す関数
+        @return ジョブと同じ順番の実行結果のリスト
+        """
+        _queue = Queue()
+        for _index, _job in enumerate(jobs):
+            _queue.put((_index, _job))
+        _results = [None] * len(jobs)
+        _progress = {'done': 0, 'total': len(jobs)}
+
+        def _work(browser):
+            while True:
+                try:
+                    _index, _job = _queue.get_nowait()
+                except Empty:
+                    return
+                try:
+                    _results[_index] = function(browser, _job)
+                except Exception as err:
+                    _results[_index] = err
+                with self._lock:
+                    _progress['done'] = _progress['done'] + 1
+                    print('Finished %d/%d jobs' % (
+                        _progress['done'], _progress['total']))
+
+        _threads = [
+            Thread(target=_work, args=(_browser,), daemon=True)
+            for _browser in self.browsers]
+        for _thread in _threads:
+            _thread.start()
+        for _thread in _threads:
+            _thread.join()
+        return _results
+
+
+class BrowserProvider(object):
+    """
+    ブラウザを必要になった時点で起動し，一定時間使われなかった場合に終了するためのクラス
+    """
+
+    def __init__(self, factory, idle_time=None, on_quit=None):
+        """
+        ブラウザを必要になった時点で起動するためのコンストラクタ
+        @param factory ブラウザを起動して返す関数，起動に失敗した場合は None を返す
+        @param idle_time ブラウザを終了するまでの待機時間， None の場合は終了しない
+        @param on_quit ブラウザを終了したときに呼び出す関数
+        """
+        self.factory = factory
+        """
+        ブラウザを起動して返す関数
+        """
+        self.idle_time = idle_time
+        """
+        ブラウザを終了するまでの待機時間
+        """
+        self.on_quit = on_quit
+        """
+        ブラウザを終了したときに呼び出す関数
+        """
+        self.browser = None
+        """
+        起動中のブラウザ
+        """
+        self._timer = None
+        """
+        待機時間が過ぎたときにブラウザを終了するタイマ
+        """
+        self._users = 0
+        """
+        ブラウザを使用中の数
+        """
+        self._lock = Lock()
+        """
+        ブラウザの起動と終了を排他するためのロック
+        """
+        return
+
+    def get(self):
+        """
+        ブラウザを取得する
+        起動していない場合は起動する
+        @return splinter のブラウザインスタンス，起動に失敗した場合は None を返す
+        """
+        with self._lock:
+            self._cancel_timer()
+            if self.browser is None:
+                self.browser = self.factory()
+            if self.browser is not None:
+                self._users = self._users + 1
+            return self.browser
+
+    def release(self):
+        """
+        ブラウザの使用を終える
+        待機時間が過ぎるまでに再び使われなかった場合はブラウザを終了する
+        """
+        with self._lock:
+            self._cancel_timer()
+            self._users = max(0, self._users - 1)
+            if self.browser is None or self.idle_time is None or (
+                    self._users != 0):
+                return
+            self._timer = Timer(self.idle_time, self._expire)
+            self._timer.daemon = True
+            self._timer.start()
+        return
+
+    def quit(self):
+        """
+        ブラウザを終了する
+        """
+        with self._lock:
+            self._quit()
+        return
+
+    def _expire(self):
+        """
+        待機時間が過ぎたときに，使用中でなければブラウザを終了する
+        """
+        with self._lock:
+            if self._users == 0:
+                print('Quit the browser after %s seconds idle' % self.idle_time)
+                self._quit()
+        return
+
+    def _quit(self):
+        """
+        ロックを取得した状態でブラウザを終了する
+        """
+        self._cancel_timer()
+        if self.browser is None:
+            return
+        self.browser.quit()
+        self.browser = None
+        if self.on_quit is not None:
+            self.on_quit()
+        return
+
+    def _cancel_timer(self):
+        """
+        ブラウザを終了するタイマを止める
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        return
@@ -4,6 +4,7 @@
 """
 
 from ebookjapan.config import Config as EbookjapanConfig
+from alphapolis.config import Config as AlphapolisConfig
 
 
 class Config(object):
@@ -37,10 +38,33 @@ class Config(object):
         """
         ログを出力するディレクトリパス
         """
+        self.profile = False
+        """
+        cProfile と tracemalloc で計測した統計情報を出力ディレクトリに書き出すかどうか
+        """
+        self.browser_idle_time = 300
+        """
+        使われていないブラウザを終了するまでの秒数
+        None の場合は終了しない
+        """
+        self.rate_limit = {
+            'rate': 10, 'max_rate': 200, 'min_rate': 0.5,
+            'max_concurrency': 16}
+        """
+        ホストごとのリクエストの制御
+        rate: 1 秒あたりのリクエスト数の初期値
+        max_rate: 1 秒あたりのリクエスト数の上限
+        min_rate: 1 秒あたりのリクエスト数の下限
+        max_concurrency: 同時実行数の上限
+        """
         self.ebookjapan = EbookjapanConfig()
         """
         ebookjapan の設定情報
         """
+        self.alphapolis = AlphapolisConfig()
+        """
+        アルファポリスの設定情報
+        """
         if isinstance(data, dict):
             self.update(data)
         return
@@ -61,6 +85,16 @@ class Config(object):
                 self.window_size['height'] = int(data['window_size']['height'])
         if 'log_directory' in data:
             self.log_directory = data['log_directory']
+        if 'profile' in data:
+            self.profile = data['profile']
+        if 'browser_idle_time' in data:
+            self.browser_idle_time = data['browser_idle_time']
+        if 'rate_limit' in data:
+            for _key in self.rate_limit:
+                if _key in data['rate_limit']:
+                    self.rate_limit[_key] = float(data['rate_limit'][_key])
         if 'ebookjapan' in data:
             self.ebookjapan.update(data['ebookjapan'])
+        if 'alphapolis' in data:
+            self.alphapolis.update(data['alphapolis'])
         return
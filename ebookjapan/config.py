@@ -4,6 +4,7 @@
 """
 
 from enum import IntEnum
+from sink import OUTPUT_DIRECTORY, OUTPUTS
 
 
 class BoundOnSide(IntEnum):
@@ -33,6 +34,48 @@ class ImageFormat(IntEnum):
     """
     PNG フォーマット
     """
+    WEBP = 3
+    """
+    非可逆圧縮の WebP フォーマット
+    """
+    WEBP_LOSSLESS = 4
+    """
+    可逆圧縮の WebP フォーマット
+    """
+
+
+class CaptureMode(IntEnum):
+    """
+    ページの画像の取得方法
+    """
+
+    SCREENSHOT = 1
+    """
+    ウィンドウ全体のスクリーンショットを撮ってトリミングする
+    """
+    CANVAS = 2
+    """
+    ビューアが描画したキャンバスや画像の画素をスクリプトで読み出す
+    読み出せない場合はスクリーンショットに切り替える
+    """
+    DEVTOOLS = 3
+    """
+    Chrome の DevTools のコマンドでページ領域だけのスクリーンショットを撮る
+    ページ領域の範囲が確定するまでと， Chrome 以外のドライバではスクリーンショットを撮る
+    """
+
+
+ENCODER_OPTIONS = {
+    ImageFormat.JPEG: {
+        'quality': int, 'subsampling': int, 'optimize': bool,
+        'progressive': bool},
+    ImageFormat.PNG: {'compress_level': int, 'optimize': bool},
+    ImageFormat.WEBP: {'quality': int, 'method': int},
+    ImageFormat.WEBP_LOSSLESS: {'quality': int, 'method': int}}
+"""
+画像のフォーマットごとに指定できるエンコーダの設定と値の型の辞書
+WebP の可逆圧縮では quality は圧縮にかける労力を表す
+"""
 
 
 class Config(object):
@@ -61,14 +104,46 @@ class Config(object):
         """
         書き出す画像フォーマット
         """
+        self.encoder_options = {
+            ImageFormat.JPEG: {'quality': 75},
+            ImageFormat.PNG: {'compress_level': 6},
+            ImageFormat.WEBP: {'quality': 80, 'method': 4},
+            ImageFormat.WEBP_LOSSLESS: {'quality': 80, 'method': 4}}
+        """
+        画像のフォーマットごとのエンコーダの設定
+        指定できる設定は ENCODER_OPTIONS に記されている
+        """
+        self.capture_mode = CaptureMode.SCREENSHOT
+        """
+        ページの画像の取得方法
+        """
         self.sleep_time = 0.5
         """
-        ページスクロールのスリープ時間
+        ページめくり後に待つ最大時間
+        ページ番号の変化と画像の読み込みが終わった時点で待機を終える
         """
         self.bound_on_side = BoundOnSide.LEFT
         """
         本の綴じ場所
         """
+        self.workers = 2
+        """
+        スクリーンショットのトリミングと書き出しを並行して行うワーカの数
+        """
+        self.resume = False
+        """
+        出力先に記録が残っている場合に書き出し済みのページの次から再開するかどうか
+        """
+        self.session_file = '/tmp/k_auto_book/ebookjapan_session.json'
+        """
+        ログイン状態を保存するファイルのパス
+        None の場合はログイン状態を保存しない
+        """
+        self.output = OUTPUT_DIRECTORY
+        """
+        ページの出力形式
+        使用できる形式は sink.OUTPUTS に記されている
+        """
         if isinstance(data, dict):
             self.update(data)
         return
@@ -86,10 +161,22 @@ class Config(object):
             self.password = data['password']
         if 'image_format' in data:
             self._set_image_format(data['image_format'])
+        if 'encoder_options' in data:
+            self._set_encoder_options(data['encoder_options'])
+        if 'capture_mode' in data:
+            self._set_capture_mode(data['capture_mode'])
         if 'sleep_time' in data:
             self.sleep_time = data['sleep_time']
         if 'bound_on_side' in data:
             self._set_bound_on_side(data['bound_on_side'])
+        if 'workers' in data:
+            self.workers = max(1, int(data['workers']))
+        if 'resume' in data:
+            self.resume = data['resume']
+        if 'session_file' in data:
+            self.session_file = data['session_file']
+        if 'output' in data:
+            self._set_output(data['output'])
         return
 
     def _set_image_format(self, format):
@@ -98,17 +185,53 @@ class Config(object):
         使用できるフォーマットは bookstore.ImageFormat.ImageFormat に記されている
         @param format 画像のフォーマット
         """
-        if isinstance(format, str):
-            _format = format.upper()
-            if _format in {ImageFormat.JPEG.name, str(int(ImageFormat.JPEG))}:
-                self.image_format = ImageFormat.JPEG
-            elif _format in {ImageFormat.PNG.name, str(int(ImageFormat.PNG))}:
-                self.image_format = ImageFormat.PNG
-        elif isinstance(format, int):
-            if format == ImageFormat.JPEG:
-                self.image_format = ImageFormat.JPEG
-            elif format == ImageFormat.PNG:
-                self.image_format = ImageFormat.PNG
+        _format = self._parse_enum(ImageFormat, format)
+        if _format is not None:
+            self.image_format = _format
+        return
+
+    def _set_capture_mode(self, mode):
+        """
+        ページの画像の取得方法を設定する
+        使用できる取得方法は CaptureMode に記されている
+        @param mode ページの画像の取得方法
+        """
+        _mode = self._parse_enum(CaptureMode, mode)
+        if _mode is not None:
+            self.capture_mode = _mode
+        return
+
+    def _parse_enum(self, enum, value):
+        """
+        列挙子の名前または番号を列挙型の値に変換する
+        @param enum 列挙型
+        @param value 列挙子の名前または番号
+        @return 該当する列挙型の値，該当するものがない場合は None を返す
+        """
+        for _member in enum:
+            if isinstance(value, str):
+                if value.upper() in {_member.name, str(int(_member))}:
+                    return _member
+            elif isinstance(value, int) and value == _member:
+                return _member
+        return None
+
+    def _set_encoder_options(self, options):
+        """
+        画像のフォーマットごとのエンコーダの設定を更新する
+        フォーマットの名前をキーとし，指定できない設定や不明なフォーマットは無視する
+        @param options フォーマットの名前をキーとするエンコーダの設定の辞書
+        """
+        if not isinstance(options, dict):
+            return
+        for _name, _options in options.items():
+            _format = self._parse_enum(ImageFormat, _name)
+            if _format is None or not isinstance(_options, dict):
+                continue
+            for _key, _type in ENCODER_OPTIONS[_format].items():
+                if _key in _options:
+                    self.encoder_options[_format][_key] = _type(
+                        _options[_key])
         return
 
     def _set_bound_on_side(self, bound_on_side):
@@ -131,3 +254,13 @@ class Config(object):
             elif bound_on_side == BoundOnSide.LEFT:
                 self.bound_on_side = BoundOnSide.LEFT
         return
+
+    def _set_output(self, output):
+        """
+        ページの出力形式を設定する
+        使用できない形式の場合は変更しない
+        @param output 出力形式
+        """
+        if isinstance(output, str) and output.lower() in OUTPUTS:
+            self.output = output.lower()
+        return
@@ -0,0 +1,123 @@
+# --- coding: utf-8 ---
+"""
+本ごとにページ領域の範囲を使い回すためのクラスモジュール
+"""
+
+from threading import Lock
+
+
+class CropBoxCache(object):
+    """
+    スクリーンショットのサイズごとにページ領域の範囲を記憶するためのクラス
+    最初の数ページで同じ範囲が続いた時点で範囲を確定し，以降は両端の画素だけを確認して使い回す
+    確認に失敗した場合は範囲を破棄し，再び検出からやり直す
+    """
+
+    CALIBRATION_COUNT = 3
+    """
+    範囲を確定するまでに同じ範囲を検出する回数
+    """
+
+    def __init__(self, check_y):
+        """
+        ページ領域の範囲を記憶するためのコンストラクタ
+        @param check_y 画像の色の判定を行う Y 座標
+        """
+        self.check_y = check_y
+        """
+        画像の色の判定を行う Y 座標
+        """
+        self.hits = 0
+        """
+        記憶した範囲を使い回した回数
+        """
+        self.misses = 0
+        """
+        範囲を検出し直した回数
+        """
+        self._boxes = {}
+        """
+        画像のサイズをキーとする，背景色の集合とページ領域の範囲と検出回数の辞書
+        """
+        self._lock = Lock()
+        """
+        記憶した範囲を更新するためのロック
+        """
+        return
+
+    def get(self, image):
+        """
+        記憶した範囲が画像にも当てはまる場合にその範囲を取得する
+        @param image 判定する画像
+        @return ページ領域の開始 X 座標と終了 X 座標のタプル，
+        範囲が確定していないか当てはまらない場合は None を返す
+        """
+        with self._lock:
+            _box = self._boxes.get(image.size)
+            if _box is None or _box['count'] < self.CALIBRATION_COUNT:
+                self.misses = self.misses + 1
+                return None
+        if not self._check_edges(image, _box['bases'], _box['range']):
+            with self._lock:
+                if self._boxes.get(image.size) is _box:
+                    del self._boxes[image.size]
+                self.misses = self.misses + 1
+            return None
+        with self._lock:
+            self.hits = self.hits + 1
+        return _box['range']
+
+    def get_confirmed(self, size):
+        """
+        画像を確認せずに確定済みのページ領域の範囲を取得する
+        @param size 画像のサイズ
+        @return ページ領域の開始 X 座標と終了 X 座標のタプル，
+        範囲が確定していない場合は None を返す
+        """
+        with self._lock:
+            _box = self._boxes.get(size)
+            if _box is None or _box['count'] < self.CALIBRATION_COUNT:
+                return None
+            self.hits = self.hits + 1
+            return _box['range']
+
+    def add(self, size, bases, range):
+        """
+        検出したページ領域の範囲を記憶する
+        直前に記憶した範囲と異なる場合は検出回数を数え直す
+        @param size 画像のサイズ
+        @param bases 背景色の集合
+        @param range ページ領域の開始 X 座標と終了 X 座標のタプル
+        """
+        if range[0] == 0 or range[1] == size[0]:
+            return
+        with self._lock:
+            _box = self._boxes.get(size)
+            if _box is not None and (
+                    _box['bases'] == bases and _box['range'] == range):
+                _box['count'] = _box['count'] + 1
+            else:
+                self._boxes[size] = {
+                    'bases': bases, 'range': range, 'count': 1}
+        return
+
+    def _check_edges(self, image, bases, range):
+        """
+        画像の四隅と範囲の境界の画素がそれぞれ背景色とページ領域の色になっているか確認する
+        @param image 判定する画像
+        @param bases 背景色の集合
+        @param range ページ領域の開始 X 座標と終了 X 座標のタプル
+        @return 記憶した範囲がそのまま当てはまる場合に True を返す
+        """
+        _width, _height = image.size
+        _start_x, _end_x = range
+        for _point in [
+                (0, 0), (0, _height - 1), (_width - 1, 0),
+                (_width - 1, _height - 1), (_start_x - 1, self.check_y),
+                (_end_x, self.check_y)]:
+            if image.getpixel(_point) not in bases:
+                return False
+        for _point in [(_start_x, self.check_y), (_end_x - 1, self.check_y)]:
+            if image.getpixel(_point) in bases:
+                return False
+        return True
@@ -3,12 +3,17 @@
 ebookjapanを使用するためにYahooアカウントでログインするためのクラスモジュール
 """
 from selenium.common.exceptions import InvalidElementStateException
+from selenium.common.exceptions import WebDriverException
 from getpass import getpass
-from urllib import request
 from PIL import Image
 from os import path
+from profiler import PhaseTimer
+import base64
+import json
 import os
 import io
+import shutil
+import sys
 import time
 
 
@@ -32,12 +37,176 @@ class YahooLogin(object):
     ログイン時にワンタイムパスワードを求めるページの URL
     """
 
-    def __init__(self, browser, yahoo_id=None, password=None):
+    CAPTCHA_IMAGE_ID = 'captchaV5MultiByteCaptchaImg'
+    """
+    画像キャプチャの img 要素の ID
+    """
+
+    CAPTCHA_SCRIPT = (
+        "(function(id) {"
+        "  var image = document.getElementById(id);"
+        "  if (!image || !image.complete || !image.naturalWidth) {"
+        "    return null;"
+        "  }"
+        "  var canvas = document.createElement('canvas');"
+        "  canvas.width = image.naturalWidth;"
+        "  canvas.height = image.naturalHeight;"
+        "  canvas.getContext('2d').drawImage(image, 0, 0);"
+        "  try {"
+        "    return canvas.toDataURL('image/png');"
+        "  } catch (error) {"
+        "    return null;"
+        "  }"
+        "})('%s')") % CAPTCHA_IMAGE_ID
+    """
+    読み込み済みの画像キャプチャを PNG の data URL として取得するスクリプト
+    """
+
+    CAPTCHA_COLUMNS = 100
+    """
+    画像キャプチャを端末に表示するときの最大の桁数
+    """
+
+    CAPTCHA_TITLE = '文字認証を行います。 - Yahoo! JAPAN'
+    """
+    画像キャプチャを求めるページのタイトル
+    """
+
+    CAPTCHA_NAMES = [
+        'captchaCdata',
+        'captchaMultiByteCaptchaId',
+        'captchaView',
+        'captchaClassInfo',
+        'captchaAnswer'
+    ]
+    """
+    画像キャプチャのフォームに含まれる input 要素の name のリスト
+    """
+
+    STATE_LOGIN_ID = 'login_id'
+    """
+    Yahoo ID の入力を待っている状態
+    """
+
+    STATE_PASSWORD = 'password'
+    """
+    パスワードの入力を待っている状態
+    """
+
+    STATE_CAPTCHA = 'captcha'
+    """
+    画像キャプチャの入力を待っている状態
+    """
+
+    STATE_ONE_TIME_PASSWORD = 'one_time_password'
+    """
+    ワンタイムパスワードの入力を待っている状態
+    """
+
+    STATE_ERROR = 'error'
+    """
+    ログインに失敗したことが表示されている状態
+    """
+
+    STATE_LOGGED_IN = 'logged_in'
+    """
+    ログインページを離れ，ログインが完了した状態
+    """
+
+    STATE_FAILED = 'failed'
+    """
+    ログインを諦めた状態
+    """
+
+    LOGIN_TRY_COUNT = 4
+    """
+    Yahoo ID とパスワードを入力する最大回数
+    """
+
+    CAPTCHA_TRY_COUNT = 3
+    """
+    画像キャプチャを入力する最大回数
+    """
+
+    ONE_TIME_PASSWORD_TRY_COUNT = 4
+    """
+    ワンタイムパスワードを入力する最大回数
+    """
+
+    INTERVAL = 0.05
+    """
+    ページの状態を確認する間隔
+    """
+
+    TIMEOUT = 30
+    """
+    次の状態に移るのを待つ最大時間
+    """
+
+    PROBE_SCRIPT = (
+        "(function(loginUrl, oneTimePasswordUrl, captchaTitle, captchaNames) {"
+        "  var url = location.href;"
+        "  var isLoginPage = url.indexOf(loginUrl) === 0;"
+        "  var isError = isLoginPage &&"
+        "    document.querySelector('div.yregertxt > h2.yjM') !== null;"
+        "  if (window.kAutoBookSubmitted) {"
+        "    return isError ? 'error' : null;"
+        "  }"
+        "  if (document.readyState !== 'complete') {"
+        "    return null;"
+        "  }"
+        "  if (url.indexOf(oneTimePasswordUrl) === 0) {"
+        "    return document.getElementsByName('verify_code').length ?"
+        "      'one_time_password' : null;"
+        "  }"
+        "  if (!isLoginPage) {"
+        "    return 'logged_in';"
+        "  }"
+        "  if (isError) {"
+        "    return 'error';"
+        "  }"
+        "  var isCaptcha = document.title === captchaTitle &&"
+        "    captchaNames.every(function(name) {"
+        "      return document.getElementsByName(name).length !== 0;"
+        "    });"
+        "  if (isCaptcha) {"
+        "    return 'captcha';"
+        "  }"
+        "  var password = document.getElementById('passwd');"
+        "  if (password && password.offsetParent !== null &&"
+        "      document.getElementById('btnSubmit')) {"
+        "    return 'password';"
+        "  }"
+        "  if (document.getElementsByName('login').length !== 0 &&"
+        "      document.getElementById('btnNext')) {"
+        "    return 'login_id';"
+        "  }"
+        "  return null;"
+        "})(%s)") % ', '.join(json.dumps(_) for _ in [
+            LOGIN_URL, ONE_TIME_PASSWORD_URL, CAPTCHA_TITLE, CAPTCHA_NAMES])
+    """
+    ページの状態を一度に判定するスクリプト
+    読み込み中か，フォームを送信した後にまだ遷移していない場合は null を返す
+    送信後に遷移せずにエラーが表示された場合はエラーを返す
+    """
+
+    SUBMIT_SCRIPT = (
+        "window.kAutoBookSubmitted = true;"
+        "Array.prototype.forEach.call("
+        "  document.querySelectorAll('div.yregertxt > h2.yjM'),"
+        "  function(element) { element.parentNode.removeChild(element); });")
+    """
+    フォームを送信する前のページに印を付け，前回のエラー表示を取り除くスクリプト
+    """
+
+    def __init__(
+            self, browser, yahoo_id=None, password=None, captcha_file=None):
         """
         Yahoo でログインするためのコンストラクタ
         @param browser splinter のブラウザインスタンス
         @param yahoo_id ヤフー ID
         @param password パスワード
+        @param captcha_file 画像キャプチャを書き出すファイルのパス
         """
         self.browser = browser
         """
@@ -53,132 +222,268 @@ class YahooLogin(object):
         パスワード
         None が設定されている場合はユーザ入力を求める
         """
+        self.captcha_file = captcha_file
+        """
+        画像キャプチャを書き出すファイルのパス
+        None が設定されている場合はファイルに書き出さない
+        """
+        self.timer = PhaseTimer()
+        """
+        ログインの手順ごとの待ち時間を集計するタイマ
+        """
+        self._password = None
+        """
+        入力中のパスワード
+        """
+        self._counts = {}
+        """
+        状態をキーとする入力を行った回数の辞書
+        """
         return
 
     def login(self):
         """
         ログインを行う
+        ページの状態ごとに入力を行い，次の状態が判定できた時点で次の入力に移る
         @return ログイン成功時に True を返す
         """
+        self.timer = PhaseTimer()
+        self._counts = {}
+        _handlers = {
+            self.STATE_LOGIN_ID: self._input_yahoo_id,
+            self.STATE_PASSWORD: self._input_password,
+            self.STATE_CAPTCHA: self._input_captcha,
+            self.STATE_ONE_TIME_PASSWORD: self._input_one_time_password,
+            self.STATE_ERROR: self._retry_login}
         print('Loading Yahoo JAPAN! top page')
         self.browser.visit(self.YAHOO_JAPAN_URL)
         print('Loading login page')
         _url = self.browser.find_by_css('#Login [data-rapid_p]').first['href']
         self.browser.visit(_url)
-        for _try_count in range(4):
-            _yahoo_id = input('Input Yahoo ID > ') if (
-                self.yahoo_id is None) else self.yahoo_id
-            _password = getpass('Input Password > ') if (
+        _state = self._wait_for('login_page', [
+            self.STATE_LOGIN_ID, self.STATE_PASSWORD, self.STATE_CAPTCHA,
+            self.STATE_ONE_TIME_PASSWORD, self.STATE_ERROR,
+            self.STATE_LOGGED_IN])
+        while _state in _handlers:
+            _state = _handlers[_state]()
+        self._print_timing()
+        if _state != self.STATE_LOGGED_IN:
+            return False
+        print('Succeeded login')
+        return True
+
+    def _input_yahoo_id(self):
+        """
+        Yahoo ID を入力し，パスワードの入力欄が表示されるのを待つ
+        @return 次の状態
+        """
+        if not self._count(self.STATE_LOGIN_ID, self.LOGIN_TRY_COUNT):
+            return self.STATE_FAILED
+        _yahoo_id = input('Input Yahoo ID > ') if (
+            self.yahoo_id is None) else self.yahoo_id
+        self._password = getpass('Input Password > ') if (
+            self.password is None) else self.password
+        print('Trying login: ' + _yahoo_id)
+        self.browser.fill('login', _yahoo_id)
+        print('Confirm Yahoo JAPAN! ID')
+        self.browser.find_by_id('btnNext').click()
+        return self._wait_for('yahoo_id', [
+            self.STATE_PASSWORD, self.STATE_CAPTCHA, self.STATE_ERROR,
+            self.STATE_LOGGED_IN])
+
+    def _input_password(self):
+        """
+        パスワードを入力して送信し，遷移先のページを待つ
+        @return 次の状態
+        """
+        if self._password is None:
+            self._password = getpass('Input Password > ') if (
                 self.password is None) else self.password
-            print('Trying login: ' + _yahoo_id)
-            self.browser.fill('login', _yahoo_id)
-            print('Confirm Yahoo JAPAN! ID')
-            self.browser.find_by_id('btnNext').click()
-            time.sleep(1)
-            self.browser.execute_script(
-                'element = document.getElementById("passwd");' +
-                'element.disabled = false;' +
-                'element.readOnly = false;')
-            self.browser.fill('passwd', _password)
-            self.browser.find_by_id('btnSubmit').click()
-            print('Trying login')
-            if self._is_login_error():
-                print('ログインに失敗しました')
-                if self.yahoo_id is not None and self.password is not None:
-                    return False
-                continue
-            for _count in range(3):
-                if self._is_image_captcha():
-                    if not self._show_image_captcha():
-                        return False
-                    _result = input('Input Captcha > ')
-                    self.browser.fill('captchaAnswer', _result)
-                    self.browser.find_by_css('input[type=image]').first.click()
-                elif self._is_login_page():
-                    break
-                else:
-                    break
-                if _count == 2 and self._is_image_captcha():
-                    print('画像キャプチャが一致しませんでした')
-                    return False
-            if not self._is_login_page():
-                _one_time_password = None
-                _is_succeeded_login = False
-                for _count in range(4):
-                    if self._is_required_one_time_password():
-                        if _one_time_password is not None:
-                            print('Invalid one time password')
-                        _one_time_password = input(
-                            'Input one time password > ')
-                        self.browser.fill('verify_code', _one_time_password)
-                        self.browser.find_by_css('[type=submit]')[0].click()
-                    else:
-                        _is_succeeded_login = True
-                        break
-                print('Succeeded login')
-                return True
-        return False
-
-    def _is_login_page(self):
-        """
-        ログインページかどうかを判定する
-        """
-        return self.browser.url.startswith(self.LOGIN_URL)
-
-    def _is_login_error(self):
-        """
-        ログインエラーかどうかを判定する
-        @return ログインエラーの場合に True を返す
-        """
-        _elements = self.browser.find_by_css('div.yregertxt > h2.yjM')
-        return self._is_login_page() and len(_elements) != 0
-
-    def _is_image_captcha(self):
-        """
-        画像キャプチャに引っかかっているかどうかを取得する
-        @return 画像キャプチャをもとめられている場合に True を返す
-        """
-        _result = self.browser.url.startswith(self.LOGIN_URL)
-        _result = _result and self.browser.title == '文字認証を行います。 - Yahoo! JAPAN'
-        if _result:
-            _names = []
-            for _input in self.browser.find_by_tag('input'):
-                _names.append(_input['name'])
-            _checks = [
-                'captchaCdata',
-                'captchaMultiByteCaptchaId',
-                'captchaView',
-                'captchaClassInfo',
-                'captchaAnswer'
-            ]
-            for _check in _checks:
-                _result = _result and _check in _names
-                if not _result:
-                    return _result
-        return _result
+        self.browser.execute_script(
+            'element = document.getElementById("passwd");' +
+            'element.disabled = false;' +
+            'element.readOnly = false;')
+        self.browser.fill('passwd', self._password)
+        print('Trying login')
+        self._submit(self.browser.find_by_id('btnSubmit'))
+        return self._wait_for('password', [
+            self.STATE_CAPTCHA, self.STATE_ONE_TIME_PASSWORD,
+            self.STATE_ERROR, self.STATE_LOGGED_IN])
+
+    def _input_captcha(self):
+        """
+        画像キャプチャを表示して入力を送信し，遷移先のページを待つ
+        @return 次の状態
+        """
+        if not self._count(self.STATE_CAPTCHA, self.CAPTCHA_TRY_COUNT):
+            print('画像キャプチャが一致しませんでした')
+            return self.STATE_FAILED
+        if not self._show_image_captcha():
+            return self.STATE_FAILED
+        _result = input('Input Captcha > ')
+        self.browser.fill('captchaAnswer', _result)
+        self._submit(self.browser.find_by_css('input[type=image]').first)
+        return self._wait_for('captcha', [
+            self.STATE_LOGIN_ID, self.STATE_PASSWORD, self.STATE_CAPTCHA,
+            self.STATE_ONE_TIME_PASSWORD, self.STATE_ERROR,
+            self.STATE_LOGGED_IN])
+
+    def _input_one_time_password(self):
+        """
+        ワンタイムパスワードを入力して送信し，遷移先のページを待つ
+        @return 次の状態
+        """
+        if 0 < self._counts.get(self.STATE_ONE_TIME_PASSWORD, 0):
+            print('Invalid one time password')
+        if not self._count(
+                self.STATE_ONE_TIME_PASSWORD,
+                self.ONE_TIME_PASSWORD_TRY_COUNT):
+            return self.STATE_FAILED
+        _one_time_password = input('Input one time password > ')
+        self.browser.fill('verify_code', _one_time_password)
+        self._submit(self.browser.find_by_css('[type=submit]')[0])
+        return self._wait_for('one_time_password', [
+            self.STATE_ONE_TIME_PASSWORD, self.STATE_ERROR,
+            self.STATE_LOGGED_IN])
+
+    def _retry_login(self):
+        """
+        ログインの失敗を表示し，入力を求められる場合は Yahoo ID の入力からやり直す
+        @return 次の状態
+        """
+        print('ログインに失敗しました')
+        self._password = None
+        if self.yahoo_id is not None and self.password is not None:
+            return self.STATE_FAILED
+        return self.STATE_LOGIN_ID
+
+    def _count(self, state, limit):
+        """
+        状態ごとの入力の回数を数える
+        @param state 入力を行う状態
+        @param limit 入力の最大回数
+        @return 最大回数に達していない場合に True を返す
+        """
+        _count = self._counts.get(state, 0)
+        if limit <= _count:
+            return False
+        self._counts[state] = _count + 1
+        return True
+
+    def _submit(self, element):
+        """
+        送信前のページに印を付けてからフォームを送信する
+        遷移前のページの状態やエラー表示を遷移先の状態と取り違えないようにする
+        @param element 送信ボタンの要素
+        """
+        self.browser.execute_script(self.SUBMIT_SCRIPT)
+        element.click()
+        return
+
+    def _probe(self):
+        """
+        ページの状態を取得する
+        遷移の途中でスクリプトを実行できない場合は判定できないものとして扱う
+        @return 状態，判定できない場合は None を返す
+        """
+        try:
+            return self.browser.evaluate_script(self.PROBE_SCRIPT)
+        except WebDriverException:
+            return None
+
+    def _wait_for(self, step, states):
+        """
+        ページが期待するいずれかの状態になるまで待ち，手順の待ち時間を記録する
+        フォームを送信してもページが遷移しない場合は時間切れの後に現在のページで判定する
+        @param step 手順名
+        @param states 期待する状態のリスト
+        @return 次の状態，判定できない場合は STATE_FAILED を返す
+        """
+        _start = time.time()
+        _limit = _start + self.TIMEOUT
+        while True:
+            _state = self._probe()
+            if _state in states:
+                break
+            if _limit <= time.time():
+                self.browser.execute_script(
+                    'window.kAutoBookSubmitted = false;')
+                _state = self._probe()
+                break
+            time.sleep(self.INTERVAL)
+        _elapsed = time.time() - _start
+        self.timer.add(step, _elapsed)
+        print('Login step: %s -> %s (%.2fs)' % (step, _state, _elapsed))
+        if _state not in states:
+            print('ログインページの状態を判定できませんでした')
+            return self.STATE_FAILED
+        return _state
+
+    def _print_timing(self):
+        """
+        ログインの手順ごとの待ち時間の合計を出力する
+        """
+        _phases = self.timer.summary()['phases']
+        print('Login wait: %.2fs (%s)' % (
+            sum(_phase['total'] for _phase in _phases.values()),
+            ', '.join('%s %.2fs' % (_step, _phase['total'])
+                      for _step, _phase in sorted(_phases.items()))))
+        return
 
     def _show_image_captcha(self):
         """
-        画像キャプチャを表示する
+        画像キャプチャを白い背景に合成し，ファイルと端末に表示する
         @return 画像の表示に成功した場合に True を返す
         """
-        _file = io.BytesIO(request.urlopen(self.browser.find_by_id(
-            'captchaV5MultiByteCaptchaImg')['src']).read())
-        _base_image = Image.open(_file)
-        _base_image = _base_image.convert('RGBA')
-        _show_image = Image.new(
-            'RGBA', _base_image.size, (0xFF, 0xFF, 0xFF, 0x0))
-        _width, _height = _base_image.size
-        for _point_x in range(_width):
-            for _point_y in range(_height):
-                _pixel = _base_image.getpixel((_point_x, _point_y))
-                if _pixel != (0, 0, 0, 0):
-                    _show_image.putpixel((_point_x, _point_y), _pixel)
-        _show_image.show()
+        _image = self._get_captcha_image()
+        if _image is None:
+            print('画像キャプチャの取得に失敗しました')
+            return False
+        _image = Image.alpha_composite(
+            Image.new('RGBA', _image.size, (0xFF, 0xFF, 0xFF, 0xFF)),
+            _image.convert('RGBA')).convert('RGB')
+        if self.captcha_file is not None:
+            _image.save(self.captcha_file)
+            print('Captcha image: %s' % self.captcha_file)
+        if sys.stdout.isatty():
+            self._print_image(_image)
         return True
 
-    def _is_required_one_time_password(self):
+    def _get_captcha_image(self):
+        """
+        読み込み済みの画像キャプチャをブラウザから取得する
+        キャンバスから読み出せない場合は要素のスクリーンショットを撮る
+        @return 画像キャプチャの画像，見つからない場合は None を返す
+        """
+        _data = self.browser.evaluate_script(self.CAPTCHA_SCRIPT)
+        if isinstance(_data, str) and ',' in _data:
+            return Image.open(io.BytesIO(
+                base64.b64decode(_data.split(',', 1)[1])))
+        if len(self.browser.find_by_id(self.CAPTCHA_IMAGE_ID)) == 0:
+            return None
+        return Image.open(io.BytesIO(self.browser.driver.find_element_by_id(
+            self.CAPTCHA_IMAGE_ID).screenshot_as_png))
+
+    def _print_image(self, image):
         """
-        ワンタイムパスワードを求められているかを確認する
+        画像を上半分のブロック文字と 24 ビットカラーのエスケープシーケンスで端末に表示する
+        1 文字で縦 2 画素を表す
+        @param image 表示する RGB の画像
         """
-        return self.browser.url.startswith(self.ONE_TIME_PASSWORD_URL)
+        _columns = min(
+            self.CAPTCHA_COLUMNS, shutil.get_terminal_size().columns)
+        _width, _height = image.size
+        if _columns < _width:
+            _height = _height * _columns // _width
+            _width = _columns
+        _height = max(2, _height + _height % 2)
+        _data = image.resize((_width, _height), Image.BOX).tobytes()
+        _stride = _width * 3
+        for _top in range(0, len(_data), _stride * 2):
+            _upper = _data[_top:_top + _stride]
+            _lower = _data[_top + _stride:_top + _stride * 2]
+            print(''.join(
+                '\x1B[38;2;%d;%d;%dm\x1B[48;2;%d;%d;%dm\u2580' % (
+                    tuple(_upper[_x:_x + 3]) + tuple(_lower[_x:_x + 3]))
+                for _x in range(0, _stride, 3)) + '\x1B[0m')
+        return
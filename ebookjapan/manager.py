@@ -6,9 +6,18 @@ ebookjapanの操作を行うためのクラスモジュール
 from datetime import datetime
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
+from selenium.common.exceptions import WebDriverException
 from PIL import Image
 from os import path
-from ebookjapan.config import Config, ImageFormat, BoundOnSide
+from ebookjapan.config import Config, ImageFormat, BoundOnSide, CaptureMode
+from ebookjapan.crop_box import CropBoxCache
+from ebookjapan.pipeline import Pipeline
+from ebookjapan.waiter import Waiter
+from manifest import Manifest
+from profiler import PhaseTimer
+from sink import OUTPUT_DIRECTORY, create_sink
+import base64
+import io
 import os
 import time
 
@@ -18,11 +27,6 @@ class Manager(object):
     ebookjapanの操作を行うためのクラス
     """
 
-    IMAGE_DIRECTORY = '/tmp/k/'
-    """
-    画像を一時的に保存するディレクトリ
-    """
-
     CHECK_Y = 100
     """
     画像の色の判定を行う Y 座標
@@ -33,15 +37,152 @@ class Manager(object):
     トリミングを容易にするための背景色
     """
 
+    TRIMING_INSET = 58
+    """
+    トリミング時に背景色との境界から内側に詰める幅
+    """
+
+    SEEK_SCRIPT = (
+        "(function(page) {"
+        "  var slider = document.querySelector('.footer input[type=range]');"
+        "  var total = document.querySelector("
+        "    '.footer__page-output > .total-pages');"
+        "  if (!slider || !total) {"
+        "    return false;"
+        "  }"
+        "  var count = Number(total.innerHTML);"
+        "  var min = Number(slider.min || 1);"
+        "  var max = Number(slider.max || count);"
+        "  var value = count <= 1 ? min :"
+        "    min + (page - 1) * (max - min) / (count - 1);"
+        "  Object.getOwnPropertyDescriptor("
+        "    HTMLInputElement.prototype, 'value'"
+        "  ).set.call(slider, String(Math.round(value)));"
+        "  slider.dispatchEvent(new Event('input', {bubbles: true}));"
+        "  slider.dispatchEvent(new Event('change', {bubbles: true}));"
+        "  return true;"
+        "})(%d)")
+    """
+    ビューアのスライダを操作して指定したページに移動するスクリプト
+    """
+
+    FINGERPRINT_SIZE = 16
+    """
+    ページの画像の指紋を求めるときに縮小する一辺の画素数
+    """
+
+    DUPLICATE_DISTANCE = 4
+    """
+    同じページとみなす画像の指紋のハミング距離の上限
+    """
+
+    BLANK_THRESHOLD = 8
+    """
+    空白の画像とみなす明るさの最大値と最小値の差の上限
+    """
+
+    RECAPTURE_COUNT = 5
+    """
+    直前のページと同じ画像や空白の画像だった場合に撮り直す回数の上限
+    """
+
+    RECAPTURE_INTERVAL = 0.1
+    """
+    スクリーンショットを撮り直す間隔
+    """
+
     MAX_LOADING_TIME = 5
     """
     初回読み込み時の最大待ち時間
     """
 
-    def __init__(self, browser, config=None, directory='./', prefix=''):
+    PAGE_TURN_TIMEOUT = 10
+    """
+    ページめくり後の待ち時間でページ番号が変わらなかった場合に追加で待つ最大時間
+    """
+
+    CANVAS_SCRIPT = (
+        "(function() {"
+        "  var elements = Array.prototype.filter.call("
+        "    document.querySelectorAll('canvas, img'), function(element) {"
+        "      var rect = element.getBoundingClientRect();"
+        "      return 0 < rect.width && 0 < rect.height &&"
+        "        0 < rect.right && rect.left < window.innerWidth &&"
+        "        0 < rect.bottom && rect.top < window.innerHeight &&"
+        "        (element.naturalWidth || element.width) &&"
+        "        getComputedStyle(element).visibility !== 'hidden';"
+        "    });"
+        "  var area = function(element) {"
+        "    var rect = element.getBoundingClientRect();"
+        "    return rect.width * rect.height;"
+        "  };"
+        "  var largest = Math.max.apply(null, elements.map(area));"
+        "  elements = elements.filter(function(element) {"
+        "    return largest / 2 <= area(element);"
+        "  });"
+        "  if (elements.length === 0) {"
+        "    return null;"
+        "  }"
+        "  var rects = elements.map(function(element) {"
+        "    return element.getBoundingClientRect();"
+        "  });"
+        "  var left = Math.min.apply(null, rects.map(function(rect) {"
+        "    return rect.left; }));"
+        "  var top = Math.min.apply(null, rects.map(function(rect) {"
+        "    return rect.top; }));"
+        "  var right = Math.max.apply(null, rects.map(function(rect) {"
+        "    return rect.right; }));"
+        "  var bottom = Math.max.apply(null, rects.map(function(rect) {"
+        "    return rect.bottom; }));"
+        "  var scale = Math.max.apply(null, elements.map("
+        "    function(element, i) {"
+        "      return (element.naturalWidth || element.width) /"
+        "        rects[i].width;"
+        "    }));"
+        "  var output = document.createElement('canvas');"
+        "  output.width = Math.round((right - left) * scale);"
+        "  output.height = Math.round((bottom - top) * scale);"
+        "  var context = output.getContext('2d');"
+        "  context.fillStyle = '#FFFFFF';"
+        "  context.fillRect(0, 0, output.width, output.height);"
+        "  elements.forEach(function(element, i) {"
+        "    context.drawImage(element,"
+        "      (rects[i].left - left) * scale, (rects[i].top - top) * scale,"
+        "      rects[i].width * scale, rects[i].height * scale);"
+        "  });"
+        "  try {"
+        "    return output.toDataURL('image/png');"
+        "  } catch (error) {"
+        "    return 'error:' + error.name;"
+        "  }"
+        "})()")
+    """
+    ビューアが表示しているページのキャンバスや画像を元の解像度で 1 枚に描き直し，
+    PNG の data URL として取得するスクリプト
+    見開きの場合は表示位置に合わせて並べる
+    """
+
+    VIEWPORT_SCRIPT = (
+        "[Math.round(window.innerWidth * window.devicePixelRatio),"
+        " Math.round(window.innerHeight * window.devicePixelRatio),"
+        " window.devicePixelRatio]")
+    """
+    表示領域の画素単位の幅と高さ，デバイスピクセル比を取得するスクリプト
+    """
+
+    DEVTOOLS_CHECK_INTERVAL = 20
+    """
+    DevTools でクリップしたスクリーンショットを続けて撮る最大回数
+    この回数ごとにウィンドウ全体のスクリーンショットを撮ってページ領域の範囲を確認する
+    """
+
+    def __init__(
+            self, browser, config=None, directory='./', prefix='',
+            bound_on_side=None):
         """
         ebookjapanの操作を行うためのコンストラクタ
         @param browser splinter のブラウザインスタンス
+        @param bound_on_side 本の綴じ場所， None の場合はページをめくって判定する
         """
         self.browser = browser
         """
@@ -71,10 +212,62 @@ class Manager(object):
         """
         現在表示されているページのページ番号が表示されるエレメント
         """
+        self.waiter = Waiter(browser)
+        """
+        ビューアの状態の変化を待つためのインスタンス
+        """
+        self.wait_times = []
+        """
+        ページめくりごとに実際に待った秒数のリスト
+        """
+        self.duplicates = []
+        """
+        再取得しても直前のページと同じ画像だったページ番号のリスト
+        """
+        self.blanks = []
+        """
+        再取得しても空白の画像だったページ番号のリスト
+        """
+        self.bound_on_side = bound_on_side
+        """
+        指定された本の綴じ場所
+        """
+        self.timer = PhaseTimer()
+        """
+        フェーズごとの所要時間の集計
+        """
+        self.crop_boxes = CropBoxCache(Manager.CHECK_Y)
+        """
+        スクリーンショットのサイズごとのページ領域の範囲
+        """
+        self.is_canvas_readable = True
+        """
+        ビューアのキャンバスの画素を読み出せるかどうか
+        """
+        self.is_devtools_available = True
+        """
+        DevTools のコマンドでスクリーンショットを撮れるかどうか
+        """
+        self._clip_count = 0
+        """
+        クリップしたスクリーンショットを続けて撮った回数
+        """
+        self.is_spread = False
+        """
+        1 回のページめくりで 2 ページ進む見開き表示かどうか
+        """
 
         self._set_directory(directory)
         self._set_prefix(prefix)
         self._set_bound_of_side(None)
+        self.manifest = Manifest(self.directory)
+        """
+        書き出したページの記録
+        """
+        self.sink = None
+        """
+        ページの出力先
+        """
         return
 
     def _set_directory(self, directory):
@@ -88,7 +281,9 @@ class Manager(object):
         _base_path = directory.rstrip('/')
         if _base_path == '':
             _base_path = '/'
-        elif not path.exists(_base_path):
+        elif not path.exists(_base_path) or (
+                self.config is not None and self.config.resume and
+                Manifest.exists(_base_path)):
             self.directory = _base_path + '/'
             return
         else:
@@ -108,12 +303,20 @@ class Manager(object):
         self.prefix = prefix
         return
 
-    def start(self):
+    def start(self, first_page=None, first_index=None):
         """
         ページの自動スクリーンショットを開始する
+        @param first_page スクリーンショットを開始するページ
+        None の場合は再開する設定であれば記録から求め，そうでなければ先頭ページから開始する
+        @param first_index 最初に書き出すファイルの連番， None の場合は first_page から求める
         @return エラーが合った場合にエラーメッセージを、成功時に True を返す
         """
-        time.sleep(2)
+        self.timer = PhaseTimer()
+        self.crop_boxes = CropBoxCache(Manager.CHECK_Y)
+        self.is_canvas_readable = True
+        self.is_devtools_available = True
+        self._clip_count = 0
+        self.is_spread = False
         _total = self._get_total_page()
         if _total is None:
             return '全ページ数の取得に失敗しました'
@@ -121,52 +324,151 @@ class Manager(object):
         if self.current_page_element is None:
             return '現在のページ情報の取得に失敗しました'
         self._change_background_color()
-        self._check_directory(Manager.IMAGE_DIRECTORY)
         self._check_directory(self.directory)
-        self._set_bound_of_side(self._get_bound_on_side())
+        if self.bound_on_side is None:
+            self._set_bound_of_side(self._get_bound_on_side())
+        else:
+            self._set_bound_of_side(self.bound_on_side)
         _extension = self._get_extension()
         _format = self._get_save_format()
-        _sleep_time = (
-            self.config.sleep_time if self.config is not None else 0.5)
-        self._move_first_page()
-        time.sleep(_sleep_time * 3)
+        _sleep_time = self._get_sleep_time()
+        if self.config is not None and self.config.resume:
+            self.manifest.load()
+        self.sink = create_sink(
+            self.config.output if self.config is not None else (
+                OUTPUT_DIRECTORY), self.directory, self.manifest)
+        if first_page is None:
+            _resume_point = self._get_resume_point(_total)
+            if _resume_point is None:
+                self.sink.close()
+                print('すべてのページが書き出し済みです')
+                return True
+            first_page, first_index = _resume_point
+        if not self.seek(first_page):
+            return '%d ページへの移動に失敗しました' % first_page
+        self.waiter.wait_for_page(None, 0, _sleep_time * 3)
         _current_url = self.browser.url
-        _current_page = 1
-        _count = 0
-        while True:
-            self._print_progress(_total, _current_page)
-            _temporary_page = Manager.IMAGE_DIRECTORY + 'K-AutoBook.png'
-            self.browser.driver.save_screenshot(_temporary_page)
-            _name = '%s%s%03d%s' % (
-                self.directory, self.prefix, _count, _extension)
-            if _current_page == _total:
-                self._triming(_temporary_page, _name, _format)
-                break
-            self._next()
-            self._triming(_temporary_page, _name, _format)
-            time.sleep(_sleep_time)
-            if _current_url != self.browser.url:
-                break
-            _current_page = self._get_current_page()
-            _count = _count + 1
+        _current_page = self._get_current_page()
+        _count = first_index if first_index is not None else first_page - 1
+        _fingerprint = None
+        _message = None
+        _pipeline = Pipeline(
+            self._write_page,
+            self.config.workers if self.config is not None else 2)
+        try:
+            while True:
+                self._print_progress(_total, _current_page)
+                _previous_fingerprint = _fingerprint
+                _image, _fingerprint, _range = self._capture(
+                    _previous_fingerprint)
+                if self._is_same_frame(_previous_fingerprint, _fingerprint):
+                    self.duplicates.append(_current_page)
+                if _fingerprint[1]:
+                    self.blanks.append(_current_page)
+                _name = '%s%s%03d%s' % (
+                    self.directory, self.prefix, _count, _extension)
+                _task = (
+                    _count, _current_page, _image, _name, _format,
+                    _range is not None, _range)
+                _is_written = self.sink.is_completed(_count)
+                if _current_page == _total:
+                    if not _is_written:
+                        _pipeline.put(*_task)
+                    break
+                _previous = self.waiter.page
+                self._next()
+                if not _is_written:
+                    _pipeline.put(*_task)
+                _wait_time = self.waiter.wait_for_page(_previous, _sleep_time)
+                if (self.waiter.page == _previous and
+                        _current_url == self.browser.url):
+                    _wait_time = _wait_time + self.waiter.wait_for_page(
+                        _previous, Manager.PAGE_TURN_TIMEOUT)
+                self.wait_times.append(_wait_time)
+                self.timer.add('wait', _wait_time)
+                if _current_url != self.browser.url:
+                    break
+                if self.waiter.page == _previous:
+                    _message = '%d ページから先に進めませんでした' % _current_page
+                    break
+                _previous_page = _current_page
+                _current_page = self._get_current_page()
+                if 2 <= _current_page - _previous_page:
+                    self.is_spread = True
+                _count = _count + 1
+        finally:
+            _errors = _pipeline.close()
+            try:
+                self.sink.close()
+            except Exception as err:
+                _errors.append((err, (None, None, None, self.directory)))
+            self._save_timing()
+        if len(_errors) != 0:
+            print()
+            for _error, _task in _errors:
+                print('画像の書き出しに失敗しました(%s): %s' % (_task[3], _error))
+            return '%d ページの書き出しに失敗しました' % len(_errors)
+        if _message is not None:
+            print()
+            return _message
         self._print_progress(_total, is_end=True)
+        self._print_report()
         return True
 
+    def _save_timing(self):
+        """
+        フェーズごとの所要時間の集計結果を出力ディレクトリに書き出す
+        """
+        if not path.isdir(self.directory):
+            return
+        _filename = self.timer.save(self.directory)
+        _summary = self.timer.summary()
+        print('Timing: %s (%.2f pages/s, %d bytes)' % (
+            _filename, _summary['pages_per_second'],
+            _summary['bytes_written']))
+        return
+
+    def _get_resume_point(self, total):
+        """
+        記録から書き出しが完了していない最初のページを求める
+        再開しない設定の場合や記録がない場合は先頭ページを返す
+        @param total 全ページ数
+        @return 再開するページと書き出すファイルの連番のタプル，
+        すべてのページが書き出し済みの場合は None を返す
+        """
+        if self.config is None or not self.config.resume:
+            return 1, 0
+        _index = self.sink.get_first_missing()
+        if _index == 0:
+            return 1, 0
+        if total <= _index:
+            return None
+        _page = self.manifest.pages[_index - 1]['source']
+        _step = 1
+        if 2 <= _index:
+            _step = max(1, _page - self.manifest.pages[_index - 2]['source'])
+        self.is_spread = 2 <= _step
+        if total < _page + _step:
+            return None
+        print('Resume from page %d' % (_page + _step))
+        return _page + _step, _index
+
     def _get_total_page(self):
         """
         全ページ数を取得する
         最初にフッタの出し入れをする
         @return 取得成功時に全ページ数を、失敗時に None を返す
         """
-        _elements = self.browser.find_by_css(
-            '.footer__page-output > .total-pages')
-        if len(_elements) == 0:
+        _selector = '.footer__page-output > .total-pages'
+        if not self.waiter.until(
+                lambda: len(self.browser.find_by_css(_selector)) != 0,
+                Manager.MAX_LOADING_TIME):
             return None
-        for _ in range(Manager.MAX_LOADING_TIME):
-            if _elements.first.html != '0':
-                return int(_elements.first.html)
-            time.sleep(1)
-        return None
+        _element = self.browser.find_by_css(_selector).first
+        if not self.waiter.until(
+                lambda: _element.html != '0', Manager.MAX_LOADING_TIME):
+            return None
+        return int(_element.html)
 
     def _get_current_page_element(self):
         """
@@ -185,6 +487,33 @@ class Manager(object):
         """
         return int(self.current_page_element.html[:-2])
 
+    def _get_sleep_time(self):
+        """
+        ページめくり後に待つ最大時間を取得する
+        @return ページめくり後に待つ最大時間
+        """
+        return self.config.sleep_time if self.config is not None else 0.5
+
+    def _print_report(self):
+        """
+        ページめくりごとに実際に待った時間と，重複や空白と判定したページ，
+        ページ領域の範囲を使い回した回数を表示する
+        """
+        if len(self.wait_times) != 0:
+            print('Page turn wait: average %.2fs, max %.2fs (%d pages)' % (
+                sum(self.wait_times) / len(self.wait_times),
+                max(self.wait_times), len(self.wait_times)))
+        if len(self.duplicates) != 0:
+            print('Duplicate pages: %s' % ', '.join(
+                str(_page) for _page in self.duplicates))
+        if len(self.blanks) != 0:
+            print('Blank pages: %s' % ', '.join(
+                str(_page) for _page in self.blanks))
+        if self.crop_boxes.hits != 0:
+            print('Crop box: reused %d times, detected %d times' % (
+                self.crop_boxes.hits, self.crop_boxes.misses))
+        return
+
     def _check_directory(self, directory):
         """
         ディレクトリの存在を確認して，ない場合はそのディレクトリを作成する
@@ -212,40 +541,277 @@ class Manager(object):
             print('\x1B[10000D', end='', flush=True)
         return
 
-    def _triming(self, source, destination, format):
+    def _get_screenshot(self):
         """
-        画像の両端の色と異なる色になる場所でトリミングする
-        @param source 元となる画像のパス
+        スクリーンショットを一時ファイルを介さずにメモリ上に取得する
+        @return PNG 形式のスクリーンショットのバイト列
+        """
+        return self.browser.driver.get_screenshot_as_png()
+
+    def _get_canvas_image(self):
+        """
+        ビューアが表示しているページの画素をキャンバスから読み出す
+        キャンバスが汚染されていて読み出せない場合は，以降はスクリーンショットを使う
+        @return PNG 形式の画像のバイト列，読み出せない場合は None を返す
+        """
+        if not self.is_canvas_readable:
+            return None
+        _result = self.browser.evaluate_script(Manager.CANVAS_SCRIPT)
+        if not isinstance(_result, str):
+            return None
+        if _result.startswith('error:'):
+            print('キャンバスを読み出せないためスクリーンショットに切り替えます(%s)' %
+                  _result[len('error:'):])
+            self.is_canvas_readable = False
+            return None
+        if ',' not in _result:
+            return None
+        return base64.b64decode(_result.split(',', 1)[1])
+
+    def _capture(self, previous):
+        """
+        ページの画像を取得し，直前のページと同じ画像や空白の画像の場合は取得し直す
+        取得し直しても変わらない場合は最後に取得した画像を返す
+        キャンバスや DevTools で取得する設定でも，取得できない場合はスクリーンショットを撮る
+        DevTools で書き出すフォーマットに変換済みの場合は画像の代わりにバイト列を返し，
+        指紋を求めるためだけに JPEG を半分の解像度のグレースケールで読み込む
+        スクリーンショットの場合は記憶したページ領域の範囲を使ってトリミングする範囲を求める
+        @param previous 直前のページの画像の指紋， None の場合は比較しない
+        @return ページの画像またはバイト列とその指紋，トリミングする X 座標の範囲のタプル，
+        トリミングが不要な場合は範囲の代わりに None を返す
+        """
+        _mode = self.config.capture_mode if (
+            self.config is not None) else CaptureMode.SCREENSHOT
+        for _try_count in range(Manager.RECAPTURE_COUNT):
+            if _try_count != 0:
+                time.sleep(Manager.RECAPTURE_INTERVAL)
+            _data = None
+            _is_clipped = False
+            if _mode == CaptureMode.CANVAS:
+                with self.timer.measure('canvas'):
+                    _data = self._get_canvas_image()
+            elif _mode == CaptureMode.DEVTOOLS:
+                with self.timer.measure('devtools'):
+                    _data = self._get_clipped_screenshot()
+                _is_clipped = _data is not None
+            _needs_triming = _data is None
+            if _needs_triming:
+                with self.timer.measure('screenshot'):
+                    _data = self._get_screenshot()
+            with self.timer.measure('decode'):
+                _image = Image.open(io.BytesIO(_data))
+                if _is_clipped:
+                    _image.draft(
+                        'L', (_image.size[0] // 2, _image.size[1] // 2))
+                _image.load()
+            _range = None
+            if _needs_triming:
+                with self.timer.measure('trim'):
+                    _range = self._get_cached_triming_range(_image)
+            _fingerprint = self._get_fingerprint(_image, _range)
+            if not _fingerprint[1] and not self._is_same_frame(
+                    previous, _fingerprint):
+                break
+        if _is_clipped and self._get_save_format() in {'jpeg', 'png'}:
+            return _data, _fingerprint, None
+        return _image, _fingerprint, _range
+
+    def _get_clipped_screenshot(self):
+        """
+        DevTools の Page.captureScreenshot でページ領域だけのスクリーンショットを撮る
+        ページ領域の範囲が確定するまでと，一定回数ごとの確認ではウィンドウ全体を撮るため None を返す
+        書き出すフォーマットが JPEG の場合は JPEG の品質を指定して JPEG で，それ以外は PNG で撮る
+        DevTools のコマンドを使えないドライバの場合は，以降はスクリーンショットを使う
+        @return 画像のバイト列，ページ領域だけを撮れない場合は None を返す
+        """
+        if not self.is_devtools_available:
+            return None
+        if not hasattr(self.browser.driver, 'execute_cdp_cmd'):
+            print('DevTools のコマンドを使えないためスクリーンショットに切り替えます')
+            self.is_devtools_available = False
+            return None
+        if Manager.DEVTOOLS_CHECK_INTERVAL <= self._clip_count:
+            self._clip_count = 0
+            return None
+        _width, _height, _ratio = self.browser.evaluate_script(
+            Manager.VIEWPORT_SCRIPT)
+        _range = self.crop_boxes.get_confirmed((_width, _height))
+        if _range is None:
+            return None
+        _start_x, _end_x = self._inset_range(_range)
+        _params = {
+            'format': 'png',
+            'clip': {
+                'x': _start_x / _ratio, 'y': 0,
+                'width': (_end_x - _start_x) / _ratio,
+                'height': _height / _ratio, 'scale': 1}}
+        if self.config.image_format == ImageFormat.JPEG:
+            _params['format'] = 'jpeg'
+            _params['quality'] = self.config.encoder_options[
+                ImageFormat.JPEG].get('quality', 75)
+        try:
+            _result = self.browser.driver.execute_cdp_cmd(
+                'Page.captureScreenshot', _params)
+        except WebDriverException as err:
+            print('DevTools でスクリーンショットを撮れないため切り替えます(%s)' % err)
+            self.is_devtools_available = False
+            return None
+        self._clip_count = self._clip_count + 1
+        return base64.b64decode(_result['data'])
+
+    def _get_fingerprint(self, image, range=None):
+        """
+        トリミング後の範囲を縮小した画像から平均ハッシュを求める
+        @param image ページの画像
+        @param range トリミングする開始 X 座標と終了 X 座標のタプル，
+        None の場合は画像全体を使う
+        @return 平均ハッシュと空白の画像かどうかのタプル
+        """
+        _width, _height = image.size
+        _start_x, _end_x = 0, _width
+        if range is not None:
+            _start_x, _end_x = range
+        if _end_x <= _start_x:
+            _start_x, _end_x = 0, _width
+        _gray = image.crop((_start_x, 0, _end_x, _height)).convert('L')
+        _minimum, _maximum = _gray.getextrema()
+        if _maximum - _minimum <= Manager.BLANK_THRESHOLD:
+            return 0, True
+        _pixels = bytearray(_gray.resize(
+            (Manager.FINGERPRINT_SIZE, Manager.FINGERPRINT_SIZE),
+            Image.BOX).tobytes())
+        _mean = sum(_pixels) / len(_pixels)
+        _hash = 0
+        for _pixel in _pixels:
+            _hash = (_hash << 1) | (1 if _mean < _pixel else 0)
+        return _hash, False
+
+    def _is_same_frame(self, previous, current):
+        """
+        2 つの画像の指紋が同じページを表しているかどうかを判定する
+        @param previous 直前のページの画像の指紋， None の場合は比較しない
+        @param current 判定する画像の指紋
+        @return 同じページと判定した場合に True を返す
+        """
+        if previous is None or previous[1] != current[1]:
+            return False
+        return bin(previous[0] ^ current[0]).count('1') <= (
+            Manager.DUPLICATE_DISTANCE)
+
+    def _write_page(
+            self, index, page, source, destination, format,
+            needs_triming=True, range=None):
+        """
+        ページの画像を必要に応じてトリミングして出力先に書き出し，記録に追加する
+        @param index ページの連番
+        @param page 画像を取得したページ番号
+        @param source 元となるページの画像，書き出すフォーマットに変換済みのバイト列も指定できる
         @param destination 出力する画像のパス
         @param format 書き出す画像のフォーマット
+        @param needs_triming 画像がトリミング前のスクリーンショットかどうか
+        @param range トリミングする X 座標の範囲， None の場合は画像から求める
         """
-        _image = Image.open(source)
-        _width, _height = _image.size
+        if isinstance(source, bytes):
+            _data = source
+        elif needs_triming:
+            _data = self._triming(source, format, range)
+        else:
+            _data = self._encode(source, format)
+        with self.timer.measure('write'):
+            self.sink.write(index, destination, page, _data)
+        self.timer.add_page(len(_data))
+        return
+
+    def _triming(self, source, format, range=None):
+        """
+        画像の両端の色と異なる色になる場所でトリミングする
+        @param source 元となるスクリーンショットの画像
+        @param format 書き出す画像のフォーマット
+        @param range トリミングする X 座標の範囲， None の場合は画像から求める
+        @return 書き出す画像のバイト列
+        """
+        with self.timer.measure('trim'):
+            _image = source
+            _width, _height = _image.size
+            _start_x, _end_x = range if range is not None else (
+                self._get_cached_triming_range(_image))
+            _image = _image.crop((_start_x, 0, _end_x, _height))
+        return self._encode(_image, format)
+
+    def _encode(self, image, format):
+        """
+        画像を書き出すフォーマットでエンコードする
+        PNG 以外は RGB でない場合に限り RGB に変換してからエンコードする
+        @param image エンコードする画像
+        @param format 書き出す画像のフォーマット
+        @return 書き出す画像のバイト列
+        """
+        with self.timer.measure('encode'):
+            if format != 'png' and image.mode != 'RGB':
+                image = image.convert('RGB')
+            _output = io.BytesIO()
+            image.save(_output, format.upper(), **self._get_encoder_options())
+        return _output.getvalue()
+
+    def _get_cached_triming_range(self, image):
+        """
+        記憶したページ領域の範囲を使ってトリミングする X 座標の範囲を取得する
+        範囲が確定していないか画像に当てはまらない場合は検出し直して記憶する
+        @param image 判定する画像
+        @return トリミングする開始 X 座標と終了 X 座標のタプル
+        """
+        _range = self.crop_boxes.get(image)
+        if _range is None:
+            _bases, _range = self._get_content_range(image)
+            self.crop_boxes.add(image.size, _bases, _range)
+        return self._inset_range(_range)
+
+    def _get_triming_range(self, image):
+        """
+        画像の両端の色と異なる色になる X 座標の範囲を取得する
+        @param image 判定する画像
+        @return トリミングする開始 X 座標と終了 X 座標のタプル
+        """
+        return self._inset_range(self._get_content_range(image)[1])
+
+    def _inset_range(self, range):
+        """
+        ページ領域の範囲を背景色との境界から内側に詰める
+        画像の左端から始まる範囲の場合は詰めない
+        @param range ページ領域の開始 X 座標と終了 X 座標のタプル
+        @return トリミングする開始 X 座標と終了 X 座標のタプル
+        """
+        _start_x, _end_x = range
+        if _start_x != 0:
+            _start_x = _start_x + Manager.TRIMING_INSET
+            _end_x = _end_x - Manager.TRIMING_INSET
+        return _start_x, _end_x
+
+    def _get_content_range(self, image):
+        """
+        画像の両端の色と異なる色になる X 座標の範囲を検出する
+        両端の列の色の集合を背景色とし， CHECK_Y の行を両端から走査して背景色以外の画素を探す
+        行の画素は一括で取り出し，背景色の数によらず 1 回の走査で判定する
+        @param image 判定する画像
+        @return 背景色の集合と，背景色以外の画素がある開始 X 座標と終了 X 座標のタプルのタプル
+        """
+        _width, _height = image.size
+        _bases = set()
+        for _point_x in {0, _width - 1}:
+            _colors = image.crop(
+                (_point_x, 0, _point_x + 1, _height)).getcolors(_height)
+            _bases.update(_color for _, _color in _colors)
+        _pixels = list(image.crop(
+            (0, Manager.CHECK_Y, _width, Manager.CHECK_Y + 1)).getdata())
         _start_x = 0
+        while _start_x < _width and _pixels[_start_x] in _bases:
+            _start_x = _start_x + 1
+        if _start_x == _width:
+            return _bases, (0, _width)
         _end_x = _width
-        _bases = set()
-        for _point_y in range(_height):
-            _bases.add(_image.getpixel((0, _point_y)))
-            _bases.add(_image.getpixel((_width - 1, _point_y)))
-        for _point_x in range(_width):
-            _pixel = _image.getpixel((_point_x, Manager.CHECK_Y))
-            if _pixel not in _bases:
-                _start_x = _point_x
-                break
-        for _point_x in range(_width)[::-1]:
-            _pixel = _image.getpixel((_point_x, Manager.CHECK_Y))
-            if _pixel not in _bases:
-                _end_x = _point_x + 1
-                break
-        if _start_x != 0:
-            _start_x = _start_x + 58
-            _end_x = _end_x - 58
-        _image = _image.crop((_start_x, 0, _end_x, _height))
-        if self.config is not None and (
-                self.config.image_format == ImageFormat.JPEG):
-            _image = _image.convert('RGB')
-        _image.save(destination, format.upper())
-        return
+        while _pixels[_end_x - 1] in _bases:
+            _end_x = _end_x - 1
+        return _bases, (_start_x, _end_x)
 
     def _next(self):
         """
@@ -262,20 +828,67 @@ class Manager(object):
         self._press_key(self.previous_key)
         return
 
-    def _move_first_page(self):
+    def seek(self, page):
+        """
+        指定したページに移動する
+        ビューアのスライダで直接移動し，スライダが使えない場合はキー入力で移動する
+        見開き表示の場合は指定したページを含む見開きに移動する
+        @param page 移動先のページ
+        @return 移動に成功した場合に True を返す
+        """
+        if self._is_on_page(page):
+            return True
+        if self.browser.evaluate_script(Manager.SEEK_SCRIPT % page):
+            if self.waiter.until(
+                    lambda: self._is_on_page(page), self._get_sleep_time()):
+                return True
+        return self._seek_by_key(page)
+
+    def _seek_by_key(self, page):
+        """
+        キー入力で指定したページに移動する
+        キーの向きが逆だった場合は綴じ場所を入れ替えて移動を続ける
+        @param page 移動先のページ
+        @return 移動に成功した場合に True を返す
+        """
+        _is_reversed = False
+        while not self._is_on_page(page):
+            _current = self._get_current_page()
+            if _current < page:
+                self._next()
+            else:
+                self._previous()
+            if not self.waiter.until(
+                    lambda: self._get_current_page() != _current,
+                    self._get_sleep_time()):
+                return False
+            if 2 <= abs(self._get_current_page() - _current):
+                self.is_spread = True
+            if abs(page - self._get_current_page()) > abs(page - _current):
+                if _is_reversed:
+                    return False
+                _is_reversed = True
+                self._set_bound_of_side(
+                    BoundOnSide.LEFT if self.next_key == Keys.ARROW_LEFT
+                    else BoundOnSide.RIGHT)
+        return True
+
+    def _is_on_page(self, page):
         """
-        先頭ページに移動
+        指定したページが表示されているかどうかを判定する
+        見開き表示と判定済みの場合は左右どちらかのページであれば表示されているとみなす
+        @param page 判定するページ
+        @return 表示されている場合に True を返す
         """
-        while self._get_current_page() != 1:
-            time.sleep(0.2)
-            self._previous()
-        return
+        _offset = page - self._get_current_page()
+        return _offset == 0 or (self.is_spread and _offset == 1)
 
     def _press_key(self, key):
         """
         指定したキーを押す
         """
-        ActionChains(self.browser.driver).key_down(key).perform()
+        with self.timer.measure('key_press'):
+            ActionChains(self.browser.driver).key_down(key).perform()
         return
 
     def _change_background_color(self):
@@ -299,6 +912,9 @@ class Manager(object):
                 return '.jpg'
             elif self.config.image_format == ImageFormat.PNG:
                 return '.png'
+            elif self.config.image_format in {
+                    ImageFormat.WEBP, ImageFormat.WEBP_LOSSLESS}:
+                return '.webp'
         return '.jpg'
 
     def _get_save_format(self):
@@ -311,16 +927,40 @@ class Manager(object):
                 return 'jpeg'
             elif self.config.image_format == ImageFormat.PNG:
                 return 'png'
+            elif self.config.image_format in {
+                    ImageFormat.WEBP, ImageFormat.WEBP_LOSSLESS}:
+                return 'webp'
         return 'jpeg'
 
+    def _get_encoder_options(self):
+        """
+        書き出すファイルフォーマットのエンコーダの設定を取得する
+        @return Image.save に渡すエンコーダの設定の辞書
+        """
+        if self.config is None:
+            return {}
+        _options = dict(self.config.encoder_options.get(
+            self.config.image_format, {}))
+        if self.config.image_format == ImageFormat.WEBP_LOSSLESS:
+            _options['lossless'] = True
+        return _options
+
     def _get_bound_on_side(self):
-        _current = self._get_current_page()
+        """
+        先頭ページで左キーを押してページが進むかどうかで本の綴じ場所を判定する
+        判定後は先頭ページに戻る
+        @return 本の綴じ場所
+        """
+        if not self.seek(1):
+            return None
         self._press_key(Keys.ARROW_LEFT)
-        time.sleep(0.2)
-        if _current < self._get_current_page():
-            return BoundOnSide.RIGHT
-        else:
+        if not self.waiter.until(
+                lambda: self._get_current_page() != 1,
+                self._get_sleep_time()):
             return BoundOnSide.LEFT
+        self._set_bound_of_side(BoundOnSide.RIGHT)
+        self.seek(1)
+        return BoundOnSide.RIGHT
 
     def _set_bound_of_side(self, bound_on_side):
         """
@@ -0,0 +1,88 @@
+# --- coding: utf-8 ---
+"""
+キャプチャした画像の加工をブラウザ操作と並行して行うためのクラスモジュール
+"""
+
+from queue import Queue
+from threading import Thread, Lock
+
+
+class Pipeline(object):
+    """
+    キャプチャした画像の加工を複数のワーカで並行して行うためのクラス
+    キューの上限に達した場合は空きができるまで投入側を待たせる
+    """
+
+    def __init__(self, function, workers=2, max_pending=None):
+        """
+        キャプチャした画像の加工を並行して行うためのコンストラクタ
+        @param function 各ワーカが実行する処理
+        @param workers ワーカの数
+        @param max_pending 処理待ちにできるタスクの最大数
+        """
+        self.function = function
+        """
+        各ワーカが実行する処理
+        """
+        self.workers = max(1, int(workers))
+        """
+        ワーカの数
+        """
+        self.errors = []
+        """
+        処理中に発生したエラーと対象のタスクのタプルのリスト
+        """
+        self._queue = Queue(
+            max_pending if max_pending is not None else self.workers * 2)
+        """
+        処理待ちのタスクのキュー
+        """
+        self._lock = Lock()
+        """
+        エラーのリストを更新するためのロック
+        """
+        self._threads = []
+        """
+        ワーカのスレッドのリスト
+        """
+        for _ in range(self.workers):
+            _thread = Thread(target=self._work, daemon=True)
+            _thread.start()
+            self._threads.append(_thread)
+        return
+
+    def put(self, *args):
+        """
+        タスクを投入する
+        キューがいっぱいの場合は空きができるまでブロックする
+        @param args 各ワーカが実行する処理に渡す引数
+        """
+        self._queue.put(args)
+        return
+
+    def close(self):
+        """
+        投入済みのタスクがすべて終わるまで待ち，ワーカを終了する
+        @return 処理中に発生したエラーと対象のタスクのタプルのリスト
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        for _thread in self._threads:
+            _thread.join()
+        self._threads = []
+        return self.errors
+
+    def _work(self):
+        """
+        キューからタスクを取り出して処理する
+        """
+        while True:
+            _task = self._queue.get()
+            if _task is None:
+                break
+            try:
+                self.function(*_task)
+            except Exception as err:
+                with self._lock:
+                    self.errors.append((err, _task))
+        return
@@ -1,6 +1,7 @@
 # --- coding: utf-8 ---
 """
 ebookjapanの実行クラスモジュール
+selenium を読み込むモジュールはブラウザを使う時点まで読み込まない
 """
 
 import re
@@ -8,9 +9,8 @@ import sys
 from os import path
 from datetime import datetime
 from runner import AbstractRunner
-from ebookjapan.login import YahooLogin
-from ebookjapan.manager import Manager
 from ebookjapan.config import BoundOnSide
+from ebookjapan.session import Session
 
 
 class Runner(AbstractRunner):
@@ -46,18 +46,10 @@ class Runner(AbstractRunner):
     def run(self):
         """
         ebookjapanの実行
+        @return 成功時に True を返す
         """
-        try:
-            if (self.config.ebookjapan.needs_login and
-                    not self._is_login() and not self._login()):
-                return
-        except Exception as err:
-            _filename = 'login_error_%s.png' % datetime.now().strftime('%s')
-            self.browser.driver.save_screenshot(
-                path.join(self.config.log_directory, _filename))
-            print('ログイン時にエラーが発生しました: %s' %
-                  err.with_traceback(sys.exc_info()[2]))
-            return
+        if not self.login():
+            return False
         print('Loading page of inputed url (%s)' % self.url)
         self.browser.visit(self.url)
 
@@ -67,15 +59,52 @@ class Runner(AbstractRunner):
             print('Open demo page')
         else:
             print('ページの取得に失敗しました')
-            return
+            return False
 
-        _destination = input('Output Path > ')
+        from ebookjapan.manager import Manager
         _manager = Manager(
-            self.browser, self.config.ebookjapan, _destination)
-        _result = _manager.start()
+            self.browser, self.config.ebookjapan, self.get_destination(),
+            bound_on_side=self.options)
+        _result = self.start_manager(_manager)
         if _result is not True:
             print(_result)
-        return
+            return False
+        return True
+
+    def login(self):
+        """
+        ログインが必要な設定の場合にログインする
+        @return ログインが不要な場合またはログインに成功した場合に True を返す
+        """
+        try:
+            if self.config.ebookjapan.needs_login and not Runner.is_login:
+                self._restore_session()
+            if (self.config.ebookjapan.needs_login and
+                    not self._is_login() and not self._login()):
+                return False
+        except Exception as err:
+            _filename = 'login_error_%s.png' % datetime.now().strftime('%s')
+            self.browser.driver.save_screenshot(
+                path.join(self.config.log_directory, _filename))
+            print('ログイン時にエラーが発生しました: %s' %
+                  err.with_traceback(sys.exc_info()[2]))
+            return False
+        return True
+
+    def parse_options(self, options):
+        """
+        オプションのパース処理
+        @param options str オプション文字列
+        @return BoundOnSide 綴じ場所が指定されている場合はその綴じ場所を，そうでない場合は None を返す
+        """
+        if options is None:
+            return None
+        _option = options.strip().upper()
+        if _option == Runner.OPTION_BOUND_ON_LEFT_SIDE:
+            return BoundOnSide.LEFT
+        elif _option == Runner.OPTION_BOUND_ON_RIGHT_SIDE:
+            return BoundOnSide.RIGHT
+        return None
 
     def _is_login(self):
         """
@@ -95,18 +124,45 @@ class Runner(AbstractRunner):
         ログイン処理を行う
         @return ログイン成功時に True を返す
         """
+        from ebookjapan.login import YahooLogin
+        _captcha_file = path.join(self.config.log_directory, 'captcha.png')
         if self.config.ebookjapan.username and self.config.ebookjapan.password:
             yahoo = YahooLogin(
                 self.browser,
                 self.config.ebookjapan.username,
-                self.config.ebookjapan.password)
+                self.config.ebookjapan.password,
+                captcha_file=_captcha_file)
         else:
-            yahoo = YahooLogin(self.browser)
+            yahoo = YahooLogin(self.browser, captcha_file=_captcha_file)
         if yahoo.login():
             Runner.is_login = True
+            self._save_session()
             return True
         return False
 
+    def _restore_session(self):
+        """
+        保存されたログイン状態をブラウザに復元する
+        期限切れの Cookie は除き，ログインできているかは _is_login で確認する
+        @return ログイン状態を復元した場合に True を返す
+        """
+        _session = Session.load(self.config.ebookjapan.session_file)
+        if _session is None or not _session.is_valid():
+            return False
+        print('Restoring saved login session')
+        _session.restore_to(self.browser)
+        return True
+
+    def _save_session(self):
+        """
+        ログイン状態をファイルに保存する
+        """
+        if self.config.ebookjapan.session_file is None:
+            return
+        Session().save_from(self.browser).save(
+            self.config.ebookjapan.session_file)
+        return
+
     def _move_main_page(self):
         """
         実際の本のページに移動する
@@ -0,0 +1,124 @@
+# --- coding: utf-8 ---
+"""
+ログイン状態を複数のブラウザや実行をまたいで共有するためのクラスモジュール
+"""
+
+from os import path
+from manifest import write_atomic
+import json
+import os
+import time
+
+
+class Session(object):
+    """
+    ブラウザの Cookie とローカルストレージをページごとに保持するためのクラス
+    """
+
+    URLS = [
+        'https://www.yahoo.co.jp/',
+        'https://login.yahoo.co.jp/',
+        'https://ebookjapan.yahoo.co.jp/']
+    """
+    ログイン状態に関わる Cookie を持つページの URL のリスト
+    """
+
+    def __init__(self, cookies=None, storages=None):
+        """
+        ブラウザの Cookie を保持するためのコンストラクタ
+        @param cookies URL をキーとする Cookie のリストの辞書
+        @param storages URL をキーとするローカルストレージの内容の辞書
+        """
+        self.cookies = cookies if isinstance(cookies, dict) else {}
+        """
+        URL をキーとする Cookie のリストの辞書
+        """
+        self.storages = storages if isinstance(storages, dict) else {}
+        """
+        URL をキーとするローカルストレージの内容の辞書
+        """
+        return
+
+    @classmethod
+    def load(cls, filename):
+        """
+        ファイルに保存したログイン状態を読み込む
+        @param filename 保存先のファイルのパス
+        @return 読み込んだログイン状態，ファイルがない場合や読み込めない場合は None を返す
+        """
+        if filename is None or not path.isfile(filename):
+            return None
+        try:
+            with open(filename, 'r') as file:
+                _data = json.load(file)
+        except ValueError:
+            return None
+        return cls(_data.get('cookies'), _data.get('storages'))
+
+    def save(self, filename):
+        """
+        ログイン状態をファイルに保存する
+        Cookie にはログイン情報が含まれるため所有者のみが読み書きできるようにする
+        @param filename 保存先のファイルのパス
+        """
+        _directory = path.dirname(filename)
+        if _directory != '' and not path.isdir(_directory):
+            os.makedirs(_directory)
+        write_atomic(filename, json.dumps({
+            'cookies': self.cookies,
+            'storages': self.storages}).encode('utf-8'), 0o600)
+        return
+
+    def is_valid(self):
+        """
+        復元する価値のあるログイン状態かどうかを判定する
+        短命な Cookie の期限切れでは無効とせず，実際のログイン状態は復元後にページで確認する
+        @return 有効期限が切れていない Cookie が残っている場合に True を返す
+        """
+        return any(
+            not self._is_expired(_cookie)
+            for _list in self.cookies.values() for _cookie in _list)
+
+    def save_from(self, browser):
+        """
+        ブラウザから Cookie とローカルストレージを取得する
+        @param browser splinter のブラウザインスタンス
+        @return self
+        """
+        for _url in Session.URLS:
+            browser.visit(_url)
+            self.cookies[_url] = browser.driver.get_cookies()
+            self.storages[_url] = json.loads(browser.evaluate_script(
+                'JSON.stringify(window.localStorage)'))
+        return self
+
+    def restore_to(self, browser):
+        """
+        ブラウザに Cookie とローカルストレージを設定する
+        Cookie はそのドメインのページを開いている状態でしか設定できないため各ページを開いてから設定する
+        有効期限が切れた Cookie は設定しない
+        @param browser splinter のブラウザインスタンス
+        """
+        for _url in Session.URLS:
+            if _url not in self.cookies and _url not in self.storages:
+                continue
+            browser.visit(_url)
+            for _cookie in self.cookies.get(_url, []):
+                if not self._is_expired(_cookie):
+                    browser.driver.add_cookie(_cookie)
+            _storage = self.storages.get(_url)
+            if _storage:
+                browser.execute_script(
+                    'var items = %s;' % json.dumps(_storage) +
+                    'for (var key in items) {' +
+                    '  window.localStorage.setItem(key, items[key]);' +
+                    '}')
+        return
+
+    def _is_expired(self, cookie):
+        """
+        Cookie の有効期限が切れているかどうかを判定する
+        @param cookie Cookie の辞書
+        @return 有効期限が切れている場合に True を返す
+        """
+        return 'expiry' in cookie and cookie['expiry'] < time.time()
@@ -0,0 +1,109 @@
+# --- coding: utf-8 ---
+"""
+ebookjapan のビューアの状態の変化を待つためのクラスモジュール
+"""
+
+import time
+
+
+class Waiter(object):
+    """
+    ページ番号の変化，画像の読み込み完了， DOM の変更の停止を待つためのクラス
+    固定時間のスリープの代わりに条件が満たされた時点で待機を終える
+    """
+
+    INTERVAL = 0.05
+    """
+    状態を確認する間隔
+    """
+
+    QUIET_TIME = 0.15
+    """
+    DOM の変更が止まったとみなすまでの時間
+    """
+
+    PROBE_SCRIPT = (
+        "(function() {"
+        "  if (window.kAutoBookLastMutation === undefined) {"
+        "    window.kAutoBookLastMutation = Date.now();"
+        "    new MutationObserver(function() {"
+        "      window.kAutoBookLastMutation = Date.now();"
+        "    }).observe(document.body, {"
+        "      childList: true, subtree: true, attributes: true});"
+        "  }"
+        "  var output = document.querySelector("
+        "    '.footer__page-output > output');"
+        "  var loaded = Array.prototype.every.call("
+        "    document.images, function(image) { return image.complete; });"
+        "  return [output ? output.innerHTML : null, loaded,"
+        "    Date.now() - window.kAutoBookLastMutation];"
+        "})()")
+    """
+    ページ番号，画像の読み込み状態，最後の DOM 変更からの経過ミリ秒を一度に取得するスクリプト
+    """
+
+    def __init__(self, browser):
+        """
+        ビューアの状態の変化を待つためのコンストラクタ
+        @param browser splinter のブラウザインスタンス
+        """
+        self.browser = browser
+        """
+        splinter のブラウザインスタンス
+        """
+        self.page = None
+        """
+        最後に確認したページ番号の文字列
+        """
+        return
+
+    def until(self, condition, timeout):
+        """
+        条件が満たされるまで待つ
+        @param condition 条件を満たした場合に True を返す関数
+        @param timeout 最大待ち時間
+        @return 条件が満たされた場合に True を返す
+        """
+        _limit = time.time() + timeout
+        while True:
+            if condition():
+                return True
+            if _limit <= time.time():
+                return False
+            time.sleep(Waiter.INTERVAL)
+
+    def probe(self):
+        """
+        ビューアの状態を取得する
+        @return ページ番号の文字列，画像の読み込みが完了しているかどうか，
+        最後の DOM 変更からの経過秒数のタプル
+        """
+        _page, _loaded, _elapsed = self.browser.evaluate_script(
+            Waiter.PROBE_SCRIPT)
+        return _page, _loaded, _elapsed / 1000
+
+    def wait_for_page(self, previous, page_timeout, load_timeout=None):
+        """
+        ページ番号が変化し，画像の読み込みと DOM の変更が終わるまで待つ
+        条件ごとに最大待ち時間を指定でき，時間切れの条件は満たされたものとして扱う
+        @param previous 待機前のページ番号の文字列， None の場合は変化を待たない
+        @param page_timeout ページ番号の変化を待つ最大時間
+        @param load_timeout 画像の読み込みと DOM の変更の停止を待つ最大時間
+        @return 実際に待った秒数
+        """
+        _start = time.time()
+        _page_limit = _start + page_timeout
+        _load_limit = _start + (
+            load_timeout if load_timeout is not None else page_timeout)
+        _changed = previous is None
+        while True:
+            _page, _loaded, _elapsed = self.probe()
+            self.page = _page
+            _now = time.time()
+            _changed = _changed or _page != previous or _page_limit <= _now
+            _ready = (_loaded and Waiter.QUIET_TIME <= _elapsed) or (
+                _load_limit <= _now)
+            if _changed and _ready:
+                break
+            time.sleep(Waiter.INTERVAL)
+        return time.time() - _start
@@ -1,18 +1,29 @@
 #!/usr/bin/env python
 # --- coding: utf-8 ---
 
+import argparse
+import io
 import json
 import os
 import re
+import shutil
+import sys
+import tempfile
+import time
 from os import path
 from PIL import Image
-from splinter import Browser
-from selenium.webdriver import ChromeOptions
 from config import Config
+from manifest import write_atomic
+from rate_limiter import RateLimiter
+from browser_pool import BrowserPool, BrowserProvider
 from ebookjapan.runner import Runner as Ebookjapan
+from ebookjapan.session import Session
 from alphapolis.runner import Runner as Alphapolis
 
 
+WINDOW_SIZE_CACHE = 'window_size.json'
+
+
 def _load_config_data():
     _file = open(
         path.join(path.abspath(path.dirname(__file__)), 'config.json'), 'r')
@@ -31,17 +42,55 @@ def _make_directory(directory):
 
 
 def _get_screenshot_size(browser):
-    _dirname = '/tmp/k'
-    _make_directory(_dirname)
-    _filename = _dirname + '/screenshot_size.png'
-    if not browser.driver.save_screenshot(_filename):
+    _screenshot = browser.driver.get_screenshot_as_png()
+    if not _screenshot:
         return None
-    return Image.open(_filename).size
+    return Image.open(io.BytesIO(_screenshot)).size
+
+
+def _get_viewport_size(browser):
+    return tuple(browser.evaluate_script(
+        '[Math.round(window.innerWidth * window.devicePixelRatio), ' +
+        'Math.round(window.innerHeight * window.devicePixelRatio)]'))
+
+
+def _get_calibration_key(browser, config):
+    _capabilities = browser.driver.capabilities
+    return '%s|%s|%s|%dx%d' % (
+        config.driver,
+        _capabilities.get('browserVersion', _capabilities.get('version')),
+        config.user_agent,
+        config.window_size['width'], config.window_size['height'])
+
 
+def _load_calibrations(filename):
+    if not path.isfile(filename):
+        return {}
+    try:
+        with open(filename, 'r') as _file:
+            return json.load(_file)
+    except ValueError:
+        return {}
 
-def _set_window_size(browser, window_size):
-    _width = window_size['width']
-    _height = window_size['height']
+
+def _save_calibration(filename, key, window, viewport):
+    _calibrations = _load_calibrations(filename)
+    _calibrations[key] = {'window': list(window), 'viewport': list(viewport)}
+    write_atomic(filename, json.dumps(
+        _calibrations, indent=2, sort_keys=True).encode('utf-8'))
+
+
+def _set_window_size(browser, config):
+    _filename = path.join(config.log_directory, WINDOW_SIZE_CACHE)
+    _key = _get_calibration_key(browser, config)
+    _calibration = _load_calibrations(_filename).get(_key)
+    if _calibration is not None:
+        browser.driver.set_window_size(*_calibration['window'])
+        if _get_viewport_size(browser) == tuple(_calibration['viewport']):
+            return True
+        print('保存されたウィンドウサイズが一致しないため再計測します')
+    _width = config.window_size['width']
+    _height = config.window_size['height']
     browser.driver.set_window_size(_width, _height)
     _size = _get_screenshot_size(browser)
     if _size is None:
@@ -51,10 +100,14 @@ def _set_window_size(browser, window_size):
         _width = int(_width * _width / _size[0])
         _height = int(_height * _height / _size[1])
         browser.driver.set_window_size(_width, _height)
+    _save_calibration(
+        _filename, _key, (_width, _height), _get_viewport_size(browser))
     return True
 
 
-def _initialize_browser(config):
+def _initialize_browser(config, user_data_directory=None):
+    from splinter import Browser
+    from selenium.webdriver import ChromeOptions
     log_name = path.join(config.log_directory, 'ghostdriver.log')
     _params = {
         'headless': True,
@@ -65,22 +118,139 @@ def _initialize_browser(config):
         _option.add_argument('--headless')
         _option.add_argument('--no-sandbox')
         _option.add_argument('--disable-dev-shm-usage')
+        if user_data_directory is not None:
+            _option.add_argument('--user-data-dir=' + user_data_directory)
         _params['chrome_options'] = _option
     _browser = Browser(config.driver, **_params)
-    if _set_window_size(_browser, config.window_size) is None:
+    if _set_window_size(_browser, config) is None:
         return None
     return _browser
 
 
-def _main():
+def _initialize_browsers(config, count):
+    _browsers = []
+    _directories = []
+    for _ in range(count):
+        _directory = tempfile.mkdtemp(prefix='k_auto_book-')
+        _directories.append(_directory)
+        _browser = _initialize_browser(config, _directory)
+        if _browser is None:
+            _quit_browsers(_browsers, _directories)
+            return None, []
+        _browsers.append(_browser)
+    return _browsers, _directories
+
+
+def _quit_browsers(browsers, directories):
+    for _browser in browsers:
+        if _browser is not None:
+            _browser.quit()
+    for _directory in directories:
+        shutil.rmtree(_directory, ignore_errors=True)
+
+
+RUNNERS = [Ebookjapan, Alphapolis]
+
+
+def _reset_login_state():
+    Ebookjapan.is_login = False
+
+
+def _needs_browser(jobs):
+    for _job in jobs:
+        _runner_class = _get_runner_class(_job['url'])
+        if _runner_class is not None and _runner_class.needs_browser:
+            return True
+    return False
+
+
+def _get_runner_class(url):
+    for _runner in RUNNERS:
+        if _runner.check(url):
+            return _runner
+    return None
+
+
+def _parse_arguments():
+    _parser = argparse.ArgumentParser(description='Download web comics.')
+    _parser.add_argument(
+        '--batch', metavar='FILE',
+        help='read jobs from FILE ("-" for stdin) instead of prompting; ' +
+        'each line is "<url> <output path> [options]"')
+    _parser.add_argument(
+        '--profile', action='store_true',
+        help='write cProfile statistics of each job to its output directory')
+    _parser.add_argument(
+        '--browsers', metavar='N', type=int, default=1,
+        help='number of browsers that run batch jobs in parallel')
+    return _parser.parse_args()
 
-    _config = Config(_load_config_data())
-    _make_directory(_config.log_directory)
-    _browser = _initialize_browser(_config)
 
-    if _browser is None:
-        return
+def _load_jobs(file):
+    _jobs = []
+    for _line in file:
+        _line = _line.strip()
+        if _line == '' or _line.startswith('#'):
+            continue
+        _fields = _line.split(None, 2)
+        _jobs.append({
+            'url': _fields[0],
+            'destination': _fields[1] if 1 < len(_fields) else None,
+            'options': _fields[2] if 2 < len(_fields) else None})
+    return _jobs
+
+
+def _run_job(browser, config, job):
+    print('Start %s' % job['url'])
+    _start = time.time()
+    _runner_class = _get_runner_class(job['url'])
+    if _runner_class is None:
+        _result = '入力されたURLはサポートしていません'
+    elif job['destination'] is None:
+        _result = '出力先のパスが指定されていません'
+    else:
+        try:
+            _result = _runner_class(
+                browser, job['url'], config, job['options'],
+                job['destination']).run()
+        except Exception as err:
+            _result = str(err)
+    if _result is not True and _result is not False:
+        print(_result)
+    return job, _result is True, time.time() - _start
+
+
+def _share_session(browsers, config, jobs):
+    if len(browsers) < 2 or not config.ebookjapan.needs_login:
+        return True
+    for _job in jobs:
+        if Ebookjapan.check(_job['url']):
+            if not Ebookjapan(browsers[0], _job['url'], config).login():
+                return False
+            _session = Session().save_from(browsers[0])
+            for _browser in browsers[1:]:
+                _session.restore_to(_browser)
+            return True
+    return True
 
+
+def _run_batch(browsers, config, jobs):
+    if not _share_session(browsers, config, jobs):
+        print('ログインに失敗しました')
+        return 1
+    _results = BrowserPool(browsers).run(
+        jobs, lambda _browser, _job: _run_job(_browser, config, _job))
+    print('Summary:')
+    for _job, _is_succeeded, _elapsed in _results:
+        print('  %s %6.1fs %s -> %s' % (
+            'OK' if _is_succeeded else 'NG', _elapsed,
+            _job['url'], _job['destination']))
+    _failures = len([_ for _ in _results if not _[1]])
+    print('%d succeeded, %d failed' % (len(_results) - _failures, _failures))
+    return 0 if _failures == 0 else 1
+
+
+def _run_interactive(provider, config):
     _stripper = re.compile(r'^ +')
     while True:
         try:
@@ -96,15 +266,63 @@ def _main():
         elif _input_data == 'exit':
             print('Bye.')
             break
-        elif Ebookjapan.check(_url):
-            _runner = Ebookjapan(_browser, _input_data, _config, _options)
-        elif Alphapolis.check(_url):
-            _runner = Alphapolis(_browser, _input_data, _config, _options)
-        else:
+        _runner_class = _get_runner_class(_url)
+        if _runner_class is None:
             print('入力されたURLはサポートしていません')
             continue
 
-        _runner.run()
+        if not _runner_class.needs_browser:
+            _runner_class(None, _input_data, config, _options).run()
+            continue
+        _browser = provider.get()
+        if _browser is None:
+            print('ブラウザの起動に失敗しました')
+            continue
+        try:
+            _runner_class(_browser, _input_data, config, _options).run()
+        finally:
+            provider.release()
+    return
+
+
+def _main():
+
+    _arguments = _parse_arguments()
+    _config = Config(_load_config_data())
+    if _arguments.profile:
+        _config.profile = True
+    _make_directory(_config.log_directory)
+    RateLimiter.shared = RateLimiter(**_config.rate_limit)
+
+    if _arguments.batch is not None:
+        if _arguments.batch == '-':
+            _jobs = _load_jobs(sys.stdin)
+        else:
+            with open(_arguments.batch, 'r') as _file:
+                _jobs = _load_jobs(_file)
+        _count = max(1, min(_arguments.browsers, len(_jobs)))
+        if _config.profile and 1 < _count:
+            print('Profiling runs jobs on a single browser')
+            _count = 1
+        if _needs_browser(_jobs):
+            _browsers, _directories = _initialize_browsers(_config, _count)
+        else:
+            _browsers, _directories = [None] * _count, []
+        if _browsers is None:
+            return 1
+        try:
+            return _run_batch(_browsers, _config, _jobs)
+        finally:
+            _quit_browsers(_browsers, _directories)
+
+    _provider = BrowserProvider(
+        lambda: _initialize_browser(_config),
+        _config.browser_idle_time, _reset_login_state)
+    try:
+        _run_interactive(_provider, _config)
+    finally:
+        _provider.quit()
+    return 0
 
 
-_main()
+sys.exit(_main())
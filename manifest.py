@@ -0,0 +1,152 @@
+# --- coding: utf-8 ---
+"""
+書き出したページの情報を記録して途中から再開するためのクラスモジュール
+"""
+
+from os import path
+from threading import Lock
+import hashlib
+import json
+import os
+
+
+def write_atomic(destination, data, mode=None):
+    """
+    一時ファイルに書き出してから名前を変更することで，書きかけのファイルを残さずに書き出す
+    パーミッションを指定した場合は，書き込む前からそのパーミッションで一時ファイルを作成する
+    @param destination 出力するファイルのパス
+    @param data 書き出すバイト列
+    @param mode 作成するファイルのパーミッション， None の場合は umask に従う
+    """
+    _temporary = destination + Manifest.TEMPORARY_SUFFIX
+    if mode is None:
+        _file = open(_temporary, 'wb')
+    else:
+        if path.lexists(_temporary):
+            os.remove(_temporary)
+        _file = os.fdopen(os.open(
+            _temporary, os.O_CREAT | os.O_EXCL | os.O_WRONLY, mode), 'wb')
+    with _file as file:
+        file.write(data)
+    os.replace(_temporary, destination)
+    return
+
+
+class Manifest(object):
+    """
+    出力ディレクトリに書き出したページの情報を管理するためのクラス
+    ページごとにファイル名，取得元，バイト数，チェックサムを記録する
+    """
+
+    FILENAME = 'manifest.json'
+    """
+    ページの情報を記録するファイル名
+    """
+
+    TEMPORARY_SUFFIX = '.part'
+    """
+    書き出し中のファイルに付ける拡張子
+    """
+
+    def __init__(self, directory):
+        """
+        ページの情報を管理するためのコンストラクタ
+        @param directory 出力ディレクトリのパス
+        """
+        self.directory = directory
+        """
+        出力ディレクトリのパス
+        """
+        self.pages = {}
+        """
+        ページの連番をキーとするページ情報の辞書
+        file: ファイル名
+        source: 取得元の URL またはスクリーンショットを撮ったページ番号
+        size: バイト数
+        checksum: SHA-256 のチェックサム
+        """
+        self._lock = Lock()
+        """
+        ページ情報を更新するためのロック
+        """
+        return
+
+    @classmethod
+    def exists(cls, directory):
+        """
+        指定したディレクトリにページ情報が記録されているかどうかを判定する
+        @param directory 出力ディレクトリのパス
+        @return ページ情報が記録されている場合に True を返す
+        """
+        return path.isfile(path.join(directory, cls.FILENAME))
+
+    def load(self):
+        """
+        記録されているページ情報を読み込む
+        @return self
+        """
+        _filename = path.join(self.directory, Manifest.FILENAME)
+        if path.isfile(_filename):
+            with open(_filename, 'r') as file:
+                _data = json.load(file)
+            self.pages = {
+                int(_index): _page
+                for _index, _page in _data.get('pages', {}).items()}
+        return self
+
+    def is_completed(self, index):
+        """
+        ページの書き出しが完了しているかどうかを判定する
+        @param index ページの連番
+        @return 記録と同じバイト数のファイルがある場合に True を返す
+        """
+        _page = self.pages.get(index)
+        if _page is None:
+            return False
+        _filename = path.join(self.directory, _page['file'])
+        return path.isfile(_filename) and (
+            path.getsize(_filename) == _page['size'])
+
+    def write(self, index, destination, source, data):
+        """
+        ページを書き出して記録する
+        @param index ページの連番
+        @param destination 出力するファイルのパス
+        @param source 取得元の URL またはページ番号
+        @param data 書き出すバイト列
+        """
+        write_atomic(destination, data)
+        self.add(
+            index, destination, source, len(data),
+            hashlib.sha256(data).hexdigest())
+        return
+
+    def add(self, index, destination, source, size, checksum):
+        """
+        書き出したページを記録する
+        @param index ページの連番
+        @param destination 出力したファイルのパス
+        @param source 取得元の URL またはページ番号
+        @param size バイト数
+        @param checksum SHA-256 のチェックサム
+        """
+        with self._lock:
+            self.pages[index] = {
+                'file': path.basename(destination),
+                'source': source,
+                'size': size,
+                'checksum': checksum}
+            self._save()
+        return
+
+    def _save(self):
+        """
+        ページ情報をファイルに書き出す
+        """
+        _data = {'pages': {
+            str(_index): self.pages[_index]
+            for _index in sorted(self.pages)}}
+        write_atomic(
+            path.join(self.directory, Manifest.FILENAME),
+            json.dumps(_data, indent=2, sort_keys=True).encode('utf-8'))
+        return
@@ -0,0 +1,159 @@
+# --- coding: utf-8 ---
+"""
+処理のフェーズごとの時間を計測し，プロファイルを出力するためのモジュール
+"""
+
+from contextlib import contextmanager
+from os import path
+from threading import Lock
+from manifest import write_atomic
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+
+
+PROFILE_FILENAME = 'profile.pstats'
+"""
+cProfile の統計情報を出力するファイル名
+"""
+
+
+def run_profiled(function, directory):
+    """
+    cProfile と tracemalloc で計測しながら関数を実行し，統計情報を出力ディレクトリに書き出す
+    ワーカのスレッドで実行される処理は cProfile の計測対象にならない
+    @param function 実行する関数
+    @param directory 統計情報を出力するディレクトリのパス
+    @return 関数の戻り値
+    """
+    _profile = cProfile.Profile()
+    tracemalloc.start()
+    try:
+        return _profile.runcall(function)
+    finally:
+        _peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        if not path.isdir(directory):
+            os.makedirs(directory)
+        _filename = path.join(directory, PROFILE_FILENAME)
+        _profile.dump_stats(_filename)
+        print('Profile: %s (peak traced memory %.1fMiB)' % (
+            _filename, _peak / 1024 / 1024))
+
+
+class PhaseTimer(object):
+    """
+    処理のフェーズごとの所要時間と書き出したバイト数を集計するためのクラス
+    """
+
+    FILENAME = 'timing.json'
+    """
+    集計結果を出力するファイル名
+    """
+
+    def __init__(self):
+        """
+        処理のフェーズごとの所要時間を集計するためのコンストラクタ
+        """
+        self.phases = {}
+        """
+        フェーズ名をキーとする所要時間のリストの辞書
+        """
+        self.bytes_written = 0
+        """
+        書き出したバイト数
+        """
+        self.pages = 0
+        """
+        書き出したページ数
+        """
+        self.started_at = time.time()
+        """
+        計測を開始した時刻
+        """
+        self._lock = Lock()
+        """
+        集計結果を更新するためのロック
+        """
+        return
+
+    @contextmanager
+    def measure(self, phase):
+        """
+        with 文で囲んだ処理の所要時間をフェーズの所要時間として記録する
+        @param phase フェーズ名
+        """
+        _start = time.time()
+        try:
+            yield
+        finally:
+            self.add(phase, time.time() - _start)
+
+    def add(self, phase, seconds):
+        """
+        フェーズの所要時間を記録する
+        @param phase フェーズ名
+        @param seconds 所要時間
+        """
+        with self._lock:
+            self.phases.setdefault(phase, []).append(seconds)
+        return
+
+    def add_page(self, size):
+        """
+        書き出したページを記録する
+        @param size 書き出したバイト数
+        """
+        with self._lock:
+            self.pages = self.pages + 1
+            self.bytes_written = self.bytes_written + size
+        return
+
+    def summary(self):
+        """
+        集計結果を取得する
+        @return フェーズごとの回数，合計，中央値， 95 パーセンタイルと，書き出したバイト数，
+        1 秒あたりのページ数の辞書
+        """
+        _elapsed = time.time() - self.started_at
+        with self._lock:
+            _phases = {}
+            for _phase, _seconds in self.phases.items():
+                _sorted = sorted(_seconds)
+                _phases[_phase] = {
+                    'count': len(_sorted),
+                    'total': sum(_sorted),
+                    'p50': self._percentile(_sorted, 50),
+                    'p95': self._percentile(_sorted, 95)}
+            return {
+                'phases': _phases,
+                'pages': self.pages,
+                'bytes_written': self.bytes_written,
+                'elapsed': _elapsed,
+                'pages_per_second': self.pages / _elapsed if (
+                    0 < _elapsed) else 0}
+
+    def save(self, directory):
+        """
+        集計結果を出力ディレクトリに書き出す
+        @param directory 出力ディレクトリのパス
+        @return 書き出したファイルのパス
+        """
+        _filename = path.join(directory, PhaseTimer.FILENAME)
+        write_atomic(_filename, json.dumps(
+            self.summary(), indent=2, sort_keys=True).encode('utf-8'))
+        return _filename
+
+    def _percentile(self, values, percent):
+        """
+        最近接順位法でパーセンタイルを求める
+        @param values 昇順に並べた値のリスト
+        @param percent パーセント
+        @return パーセンタイルの値
+        """
+        if len(values) == 0:
+            return 0
+        _rank = max(1, -(-len(values) * percent // 100))
+        return values[int(_rank) - 1]
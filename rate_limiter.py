@@ -0,0 +1,296 @@
+# --- coding: utf-8 ---
+"""
+外部への HTTP リクエストの頻度と同時実行数をホストごとに制御するためのモジュール
+"""
+
+from contextlib import contextmanager
+from threading import Condition, Lock
+from urllib.parse import urlparse
+import socket
+import time
+import urllib3
+
+
+THROTTLE_STATUSES = [429, 503]
+"""
+リクエストを減らすべきと判断する HTTP ステータスコードのリスト
+"""
+
+TIMEOUT_ERRORS = (socket.timeout, urllib3.exceptions.TimeoutError)
+"""
+リクエストを減らすべきと判断するタイムアウトの例外のタプル
+"""
+
+
+class HostLimiter(object):
+    """
+    1 つのホストへのリクエストの頻度をトークンバケットで，同時実行数を AIMD で制御するクラス
+    最初に制限を受けるまでは同時実行数と頻度を倍々に増やし，以降は少しずつ増やす
+    制限を受けた場合やタイムアウトした場合は同時実行数と頻度を半分にする
+    """
+
+    def __init__(self, rate, max_rate, min_rate, max_concurrency):
+        """
+        ホストへのリクエストを制御するためのコンストラクタ
+        @param rate 1 秒あたりのリクエスト数の初期値
+        @param max_rate 1 秒あたりのリクエスト数の上限
+        @param min_rate 1 秒あたりのリクエスト数の下限
+        @param max_concurrency 同時実行数の上限
+        """
+        self.rate = float(rate)
+        """
+        1 秒あたりのリクエスト数
+        """
+        self.max_rate = float(max_rate)
+        """
+        1 秒あたりのリクエスト数の上限
+        """
+        self.min_rate = float(min_rate)
+        """
+        1 秒あたりのリクエスト数の下限
+        """
+        self.concurrency = min(2.0, float(max_concurrency))
+        """
+        同時実行数の上限の現在値
+        """
+        self.max_concurrency = int(max_concurrency)
+        """
+        同時実行数の上限
+        """
+        self.in_flight = 0
+        """
+        実行中のリクエスト数
+        """
+        self._tokens = 1.0
+        """
+        トークンバケットに残っているトークン数
+        """
+        self._updated_at = time.monotonic()
+        """
+        トークンを最後に補充した時刻
+        """
+        self._paused_until = 0
+        """
+        Retry-After で指定されたリクエストを再開できる時刻
+        """
+        self._decreased_at = 0
+        """
+        同時実行数と頻度を最後に減らした時刻
+        """
+        self._is_slow_start = True
+        """
+        まだ制限を受けておらず同時実行数と頻度を倍々に増やしているかどうか
+        """
+        self._condition = Condition()
+        """
+        リクエストの開始を待つための条件変数
+        """
+        return
+
+    def acquire(self):
+        """
+        リクエストを開始できるまで待つ
+        @return リクエストを開始した時刻
+        """
+        with self._condition:
+            while True:
+                _now = time.monotonic()
+                self._refill(_now)
+                _wait = self._paused_until - _now
+                if _wait <= 0 and self.in_flight < int(self.concurrency):
+                    if 1 <= self._tokens:
+                        self._tokens = self._tokens - 1
+                        self.in_flight = self.in_flight + 1
+                        return _now
+                    _wait = (1 - self._tokens) / self.rate
+                self._condition.wait(_wait if 0 < _wait else None)
+
+    def release(self, started_at, is_throttled=False, retry_after=None):
+        """
+        リクエストの終了を記録し，結果に応じて同時実行数と頻度を調整する
+        同じ時期に始まったリクエストが続けて制限を受けても減らすのは 1 回だけにする
+        @param started_at リクエストを開始した時刻
+        @param is_throttled 制限を受けたかタイムアウトした場合に True を指定する
+        @param retry_after リクエストを再開できるまでの秒数
+        """
+        with self._condition:
+            self.in_flight = self.in_flight - 1
+            if is_throttled:
+                _now = time.monotonic()
+                if retry_after is not None:
+                    self._paused_until = max(
+                        self._paused_until, _now + retry_after)
+                if self._decreased_at <= started_at:
+                    self._is_slow_start = False
+                    self._decreased_at = _now
+                    self.concurrency = max(1.0, self.concurrency / 2)
+                    self.rate = max(self.min_rate, self.rate / 2)
+            elif self._is_slow_start:
+                self.concurrency = min(
+                    self.max_concurrency, self.concurrency + 1)
+                self.rate = min(
+                    self.max_rate, self.rate + self.rate / self.concurrency)
+            else:
+                self.concurrency = min(
+                    self.max_concurrency,
+                    self.concurrency + 1 / self.concurrency)
+                self.rate = min(
+                    self.max_rate, self.rate + 1 / self.concurrency)
+            self._condition.notify_all()
+        return
+
+    def _refill(self, now):
+        """
+        経過時間に応じてトークンを補充する
+        同時実行数の上限を超えてはトークンを貯めない
+        @param now 現在時刻
+        """
+        self._tokens = min(
+            max(1.0, self.concurrency),
+            self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+        return
+
+
+class Slot(object):
+    """
+    制御下で実行中の 1 つのリクエストの結果を記録するクラス
+    """
+
+    def __init__(self, started_at):
+        """
+        実行中のリクエストの結果を記録するためのコンストラクタ
+        @param started_at リクエストを開始した時刻
+        """
+        self.started_at = started_at
+        """
+        リクエストを開始した時刻
+        """
+        self.is_throttled = False
+        """
+        制限を受けたかタイムアウトしたかどうか
+        """
+        self.retry_after = None
+        """
+        リクエストを再開できるまでの秒数
+        """
+        return
+
+    def report(self, status, retry_after=None):
+        """
+        レスポンスの HTTP ステータスコードを記録する
+        @param status HTTP ステータスコード
+        @param retry_after Retry-After ヘッダの値
+        """
+        if status in THROTTLE_STATUSES:
+            self.is_throttled = True
+            if retry_after is not None and str(retry_after).isdigit():
+                self.retry_after = int(retry_after)
+        return
+
+
+class RateLimiter(object):
+    """
+    ホストごとにリクエストの頻度と同時実行数を制御するクラス
+    """
+
+    shared = None
+    """
+    プロセス全体で共有するインスタンス
+    """
+
+    def __init__(
+            self, rate=10, max_rate=200, min_rate=0.5, max_concurrency=16):
+        """
+        ホストごとにリクエストを制御するためのコンストラクタ
+        @param rate ホストごとの 1 秒あたりのリクエスト数の初期値
+        @param max_rate ホストごとの 1 秒あたりのリクエスト数の上限
+        @param min_rate ホストごとの 1 秒あたりのリクエスト数の下限
+        @param max_concurrency ホストごとの同時実行数の上限
+        """
+        self.rate = rate
+        """
+        ホストごとの 1 秒あたりのリクエスト数の初期値
+        """
+        self.max_rate = max_rate
+        """
+        ホストごとの 1 秒あたりのリクエスト数の上限
+        """
+        self.min_rate = min_rate
+        """
+        ホストごとの 1 秒あたりのリクエスト数の下限
+        """
+        self.max_concurrency = max_concurrency
+        """
+        ホストごとの同時実行数の上限
+        """
+        self._hosts = {}
+        """
+        ホスト名をキーとする HostLimiter の辞書
+        """
+        self._lock = Lock()
+        """
+        ホストの辞書を更新するためのロック
+        """
+        return
+
+    @classmethod
+    def get_shared(cls):
+        """
+        プロセス全体で共有するインスタンスを取得する
+        @return 共有する RateLimiter
+        """
+        if cls.shared is None:
+            cls.shared = cls()
+        return cls.shared
+
+    def get(self, url):
+        """
+        URL のホストへのリクエストを制御するインスタンスを取得する
+        @param url リクエストする URL
+        @return HostLimiter
+        """
+        _host = urlparse(url).netloc
+        with self._lock:
+            if _host not in self._hosts:
+                self._hosts[_host] = HostLimiter(
+                    self.rate, self.max_rate, self.min_rate,
+                    self.max_concurrency)
+            return self._hosts[_host]
+
+    @contextmanager
+    def limit(self, url):
+        """
+        with 文で囲んだリクエストを制御下で実行する
+        囲んだ処理ではレスポンスを受け取った時点で Slot.report を呼び出す
+        HTTP エラーやタイムアウトの例外も結果として記録する
+        @param url リクエストする URL
+        """
+        _host = self.get(url)
+        _slot = Slot(_host.acquire())
+        try:
+            yield _slot
+        except Exception as err:
+            if hasattr(err, 'code') and hasattr(err, 'headers'):
+                _slot.report(err.code, err.headers.get('Retry-After'))
+            if isinstance(err, TIMEOUT_ERRORS) or isinstance(
+                    getattr(err, 'reason', None), TIMEOUT_ERRORS):
+                _slot.is_throttled = True
+            raise
+        finally:
+            _host.release(
+                _slot.started_at, _slot.is_throttled, _slot.retry_after)
+
+    def stats(self):
+        """
+        ホストごとの現在の頻度と同時実行数を取得する
+        @return ホスト名をキーとする 1 秒あたりのリクエスト数，同時実行数の上限，
+        実行中のリクエスト数の辞書
+        """
+        with self._lock:
+            return {
+                _host: {
+                    'rate': _limiter.rate,
+                    'concurrency': int(_limiter.concurrency),
+                    'in_flight': _limiter.in_flight}
+                for _host, _limiter in self._hosts.items()}
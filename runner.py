@@ -5,6 +5,7 @@
 
 import re
 from abc import ABCMeta, abstractmethod
+from profiler import run_profiled
 
 
 class AbstractRunner(metaclass=ABCMeta):
@@ -27,6 +28,11 @@ class AbstractRunner(metaclass=ABCMeta):
     サポートする URL かどうかの判定機
     """
 
+    needs_browser = True
+    """
+    実行にブラウザが必要かどうか
+    """
+
     @classmethod
     def _initialize_checker(cls):
         """
@@ -53,13 +59,15 @@ class AbstractRunner(metaclass=ABCMeta):
                 return True
         return False
 
-    def __init__(self, browser, url, config=None, options=None):
+    def __init__(
+            self, browser, url, config=None, options=None, destination=None):
         """
         ブックストアで実行するためのコンストラクタ
         @param borwser splinter のブラウザ情報
         @param url str アクセスする URL
         @param config Config 設定情報
         @param options str オプション情報
+        @param destination str 出力先のパス， None の場合は実行時に入力を求める
         """
 
         self.browser = browser
@@ -82,15 +90,44 @@ class AbstractRunner(metaclass=ABCMeta):
         オプションとして指定する文字列
         オプションのパース方法は継承先に依存する
         """
+
+        self.destination = destination
+        """
+        出力先のパス
+        """
         return
 
     @abstractmethod
     def run(self):
         """
         実行メソッド
+        @return 成功時に True を返す
         """
         pass
 
+    def start_manager(self, manager, *args):
+        """
+        マネージャの処理を開始する
+        プロファイルを取る設定の場合は計測しながら実行する
+        @param manager 開始するマネージャ
+        @param args マネージャの start メソッドに渡す引数
+        @return マネージャの start メソッドの戻り値
+        """
+        if self.config is not None and self.config.profile:
+            return run_profiled(
+                lambda: manager.start(*args), manager.directory)
+        return manager.start(*args)
+
+    def get_destination(self):
+        """
+        出力先のパスを取得する
+        指定されていない場合は入力を求める
+        @return str 出力先のパス
+        """
+        if self.destination is None:
+            self.destination = input('Output Path > ')
+        return self.destination
+
     def parse_options(self, options):
         """
         オプションのパース処理
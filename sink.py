@@ -0,0 +1,370 @@
+# --- coding: utf-8 ---
+"""
+書き出したページの出力先を切り替えるためのクラスモジュール
+ページを 1 ファイルずつ書き出すほか， CBZ や PDF にページごとに追記できる
+"""
+
+from os import path
+from threading import Lock
+from PIL import Image
+from manifest import Manifest
+import hashlib
+import io
+import os
+import zipfile
+
+
+OUTPUT_DIRECTORY = 'directory'
+"""
+ページを 1 ファイルずつディレクトリに書き出す出力形式
+"""
+
+OUTPUT_CBZ = 'cbz'
+"""
+ページを無圧縮の CBZ に追記する出力形式
+"""
+
+OUTPUT_PDF = 'pdf'
+"""
+ページを PDF に追記する出力形式
+"""
+
+OUTPUTS = [OUTPUT_DIRECTORY, OUTPUT_CBZ, OUTPUT_PDF]
+"""
+使用できる出力形式のリスト
+"""
+
+
+def create_sink(output, directory, manifest):
+    """
+    出力形式に応じた出力先を生成する
+    @param output 出力形式
+    @param directory 出力ディレクトリのパス
+    @param manifest 書き出したページの記録
+    @return 出力先
+    """
+    if output == OUTPUT_CBZ:
+        return ZipSink(directory, manifest)
+    elif output == OUTPUT_PDF:
+        return PdfSink(directory, manifest)
+    return DirectorySink(directory, manifest)
+
+
+class DirectorySink(object):
+    """
+    ページを 1 ファイルずつディレクトリに書き出す出力先
+    """
+
+    def __init__(self, directory, manifest):
+        """
+        ページをディレクトリに書き出すためのコンストラクタ
+        @param directory 出力ディレクトリのパス
+        @param manifest 書き出したページの記録
+        """
+        self.directory = directory
+        """
+        出力ディレクトリのパス
+        """
+        self.manifest = manifest
+        """
+        書き出したページの記録
+        """
+        self._lock = Lock()
+        """
+        出力先への書き込みを排他するためのロック
+        """
+        return
+
+    def is_completed(self, index):
+        """
+        ページの書き出しが完了しているかどうかを判定する
+        @param index ページの連番
+        @return 書き出しが完了している場合に True を返す
+        """
+        return self.manifest.is_completed(index)
+
+    def get_first_missing(self):
+        """
+        書き出しが完了していない最初のページの連番を取得する
+        @return 書き出しが完了していない最初のページの連番
+        """
+        _index = 0
+        while self.is_completed(_index):
+            _index = _index + 1
+        return _index
+
+    def write(self, index, destination, source, data):
+        """
+        ページを書き出す
+        @param index ページの連番
+        @param destination ページのファイルのパス
+        @param source 取得元の URL またはページ番号
+        @param data 画像のバイト列
+        """
+        self.manifest.write(index, destination, source, data)
+        return
+
+    def write_file(self, index, destination, source, filename, checksum):
+        """
+        一時ファイルに書き出し済みのページを書き出す
+        一時ファイルは書き出し後に削除される
+        @param index ページの連番
+        @param destination ページのファイルのパス
+        @param source 取得元の URL またはページ番号
+        @param filename 一時ファイルのパス
+        @param checksum SHA-256 のチェックサム
+        """
+        _size = path.getsize(filename)
+        os.replace(filename, destination)
+        self.manifest.add(index, destination, source, _size, checksum)
+        return
+
+    def close(self):
+        """
+        出力先を閉じる
+        """
+        return
+
+
+class ZipSink(DirectorySink):
+    """
+    ページを無圧縮の CBZ にページごとに追記する出力先
+    ページごとに開き直すため，ページを書き終えるたびに有効なアーカイブになる
+    """
+
+    EXTENSION = '.cbz'
+    """
+    アーカイブの拡張子
+    """
+
+    def __init__(self, directory, manifest):
+        """
+        ページを CBZ に追記するためのコンストラクタ
+        @param directory 出力ディレクトリのパス
+        @param manifest 書き出したページの記録
+        """
+        super().__init__(directory, manifest)
+        self.filename = path.join(
+            directory, path.basename(directory.rstrip('/')) + self.EXTENSION)
+        """
+        アーカイブのパス
+        """
+        self._names = set()
+        """
+        アーカイブに含まれるファイル名の集合
+        """
+        if len(manifest.pages) != 0 and zipfile.is_zipfile(self.filename):
+            with zipfile.ZipFile(self.filename, 'r') as _archive:
+                self._names = set(_archive.namelist())
+        return
+
+    def is_completed(self, index):
+        """
+        ページの書き出しが完了しているかどうかを判定する
+        @param index ページの連番
+        @return 記録されたページがアーカイブに含まれている場合に True を返す
+        """
+        _page = self.manifest.pages.get(index)
+        return _page is not None and _page['file'] in self._names
+
+    def write(self, index, destination, source, data):
+        """
+        ページをアーカイブに追記する
+        @param index ページの連番
+        @param destination ページのファイルのパス，アーカイブ内のファイル名に使う
+        @param source 取得元の URL またはページ番号
+        @param data 画像のバイト列
+        """
+        _name = path.basename(destination)
+        _checksum = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            if not self._is_written(index, _name, _checksum):
+                self._store(
+                    _name, lambda _archive: _archive.writestr(_name, data))
+        self.manifest.add(index, _name, source, len(data), _checksum)
+        return
+
+    def write_file(self, index, destination, source, filename, checksum):
+        """
+        一時ファイルに書き出し済みのページをアーカイブに追記する
+        一時ファイルは追記後に削除される
+        @param index ページの連番
+        @param destination ページのファイルのパス，アーカイブ内のファイル名に使う
+        @param source 取得元の URL またはページ番号
+        @param filename 一時ファイルのパス
+        @param checksum SHA-256 のチェックサム
+        """
+        _name = path.basename(destination)
+        _size = path.getsize(filename)
+        with self._lock:
+            if not self._is_written(index, _name, checksum):
+                self._store(
+                    _name, lambda _archive: _archive.write(filename, _name))
+        os.remove(filename)
+        self.manifest.add(index, _name, source, _size, checksum)
+        return
+
+    def _is_written(self, index, name, checksum):
+        """
+        同じ内容のページがすでにアーカイブに含まれているかどうかを判定する
+        @param index ページの連番
+        @param name アーカイブ内のファイル名
+        @param checksum SHA-256 のチェックサム
+        @return 記録と同じチェックサムのファイルが含まれている場合に True を返す
+        """
+        _page = self.manifest.pages.get(index)
+        return name in self._names and _page is not None and (
+            _page['file'] == name and _page['checksum'] == checksum)
+
+    def _store(self, name, store):
+        """
+        アーカイブにファイルを書き込む
+        同じ名前のファイルがある場合は ZIP から削除できないため，
+        古いファイルの位置に書き込みながら一時ファイルに書き写して置き換える
+        @param name アーカイブ内のファイル名
+        @param store 開いた ZipFile にファイルを書き込む関数
+        """
+        if name not in self._names:
+            with self._open() as _archive:
+                store(_archive)
+            self._names.add(name)
+            return
+        _temporary = self.filename + Manifest.TEMPORARY_SUFFIX
+        _is_stored = False
+        with zipfile.ZipFile(self.filename, 'r') as _source:
+            with zipfile.ZipFile(
+                    _temporary, 'w', zipfile.ZIP_STORED) as _archive:
+                for _info in _source.infolist():
+                    if _info.filename != name:
+                        _archive.writestr(_info, _source.read(_info))
+                    elif not _is_stored:
+                        store(_archive)
+                        _is_stored = True
+        os.replace(_temporary, self.filename)
+        return
+
+    def _open(self):
+        """
+        アーカイブを追記するために開く
+        書き出し済みのページがない場合は既存のアーカイブを作り直す
+        @return 無圧縮で書き込む ZipFile
+        """
+        return zipfile.ZipFile(
+            self.filename, 'a' if len(self._names) != 0 else 'w',
+            zipfile.ZIP_STORED)
+
+
+class PdfSink(DirectorySink):
+    """
+    ページを PDF にページ順に追記する出力先
+    先のページが書き出されるまで後のページは保留し，順番がそろった時点で追記する
+    """
+
+    EXTENSION = '.pdf'
+    """
+    PDF の拡張子
+    """
+
+    def __init__(self, directory, manifest):
+        """
+        ページを PDF に追記するためのコンストラクタ
+        @param directory 出力ディレクトリのパス
+        @param manifest 書き出したページの記録
+        """
+        super().__init__(directory, manifest)
+        self.filename = path.join(
+            directory, path.basename(directory.rstrip('/')) + self.EXTENSION)
+        """
+        PDF のパス
+        """
+        self._pending = {}
+        """
+        ページの連番をキーとする追記待ちのページの辞書
+        """
+        self._next = 0
+        """
+        次に追記するページの連番
+        """
+        if path.isfile(self.filename):
+            while self._next in self.manifest.pages:
+                self._next = self._next + 1
+        return
+
+    def is_completed(self, index):
+        """
+        ページの書き出しが完了しているかどうかを判定する
+        @param index ページの連番
+        @return PDF に追記済みの場合に True を返す
+        """
+        return index < self._next
+
+    def write(self, index, destination, source, data):
+        """
+        ページを PDF に追記する
+        @param index ページの連番
+        @param destination ページのファイルのパス，記録するファイル名に使う
+        @param source 取得元の URL またはページ番号
+        @param data 画像のバイト列
+        """
+        with self._lock:
+            self._pending[index] = (destination, source, data, None)
+            self._flush()
+        return
+
+    def write_file(self, index, destination, source, filename, checksum):
+        """
+        一時ファイルに書き出し済みのページを PDF に追記する
+        追記待ちの間も画像は一時ファイルに置いたままにする
+        @param index ページの連番
+        @param destination ページのファイルのパス，記録するファイル名に使う
+        @param source 取得元の URL またはページ番号
+        @param filename 一時ファイルのパス
+        @param checksum SHA-256 のチェックサム
+        """
+        with self._lock:
+            self._pending[index] = (destination, source, filename, checksum)
+            self._flush()
+        return
+
+    def close(self):
+        """
+        追記待ちのページを破棄して閉じる
+        PDF には欠けたページより後を追記しないため，再開時には欠けたページから取得し直す
+        """
+        with self._lock:
+            _indexes = sorted(self._pending)
+            for _index in _indexes:
+                _, _, _data, _checksum = self._pending.pop(_index)
+                if _checksum is not None:
+                    os.remove(_data)
+        if len(_indexes) != 0:
+            print('%d ページ目が欠けているため %d ページを PDF に追記しませんでした' % (
+                self._next, len(_indexes)))
+        return
+
+    def _flush(self):
+        """
+        次に追記するページから連続して揃っているページを追記する
+        """
+        while self._next in self._pending:
+            _destination, _source, _data, _checksum = self._pending.pop(
+                self._next)
+            _is_file = _checksum is not None
+            if _is_file:
+                _size = path.getsize(_data)
+                _file = _data
+            else:
+                _size = len(_data)
+                _checksum = hashlib.sha256(_data).hexdigest()
+                _file = io.BytesIO(_data)
+            with Image.open(_file) as _image:
+                _page = _image
+                if _image.mode not in {'RGB', 'L', '1', 'CMYK'}:
+                    _page = _image.convert('RGB')
+                _page.save(self.filename, 'PDF', append=0 < self._next)
+            if _is_file:
+                os.remove(_data)
+            self.manifest.add(
+                self._next, _destination, _source, _size, _checksum)
+            self._next = self._next + 1
+        return